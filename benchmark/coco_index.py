@@ -0,0 +1,95 @@
+"""Benchmark reading the annotations of every image of a coco file.
+
+A synthetic geococo.json with --images images and --annotations annotations
+per image is read image by image, e.g.
+
+    python benchmark/coco_index.py --images 20000 --annotations 20
+
+The dict index parses the whole file and groups the annotation dicts by
+image like pycocotools does, the coco index streams the file into array
+columns, or loads them from its saved .npz.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from ohsome2label.coco import CocoIndex, index_path
+
+
+def make_coco(fpath, images, annotations, seed=0):
+    rnd = random.Random(seed)
+    with open(fpath, "w") as f:
+        f.write('{"images": [')
+        f.write(",".join(
+            json.dumps({"id": i, "width": 256, "height": 256,
+                        "file_name": "18.{}.0.png".format(i)})
+            for i in range(images)
+        ))
+        f.write('], "annotations": [')
+        for i in range(images * annotations):
+            ring = [round(rnd.uniform(0, 256), 6) for _ in range(2 * rnd.randint(4, 40))]
+            anno = {"id": i, "category_id": rnd.randint(1, 3), "iscrowd": 0,
+                    "image_id": i // annotations, "segmentation": [ring],
+                    "area": rnd.uniform(0, 1000), "bbox": ring[:4]}
+            f.write(("," if i else "") + json.dumps(anno))
+        f.write('], "categories": [')
+        f.write(",".join(
+            json.dumps({"id": i, "name": "c{}".format(i)}) for i in (1, 2, 3)
+        ))
+        f.write("]}")
+
+
+def read_dicts(fpath):
+    with open(fpath) as f:
+        coco = json.load(f)
+    img_to_anns = defaultdict(list)
+    for anno in coco["annotations"]:
+        img_to_anns[anno["image_id"]].append(anno)
+    cats = {cat["id"]: cat for cat in coco["categories"]}
+    for img in coco["images"]:
+        anns = img_to_anns[img["id"]]
+        bboxes = np.array([anno["bbox"] for anno in anns]) / 256
+        names = [cats[anno["category_id"]]["name"] for anno in anns]
+        yield bboxes, names
+
+
+def read_index(index):
+    for i in range(len(index)):
+        anns = index.annotations(i)
+        bboxes = index.bboxes[anns] / 256
+        names = [index.category_name(c) for c in index.category_ids[anns].tolist()]
+        yield bboxes, names
+
+
+def run(name, load):
+    start = time.perf_counter()
+    images = sum(1 for _ in load())
+    elapsed = time.perf_counter() - start
+    print("{:>6}: {:7d} images {:8.3f}s".format(name, images, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=5000)
+    parser.add_argument("--annotations", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fpath = os.path.join(tmp, "geococo.json")
+        make_coco(fpath, args.images, args.annotations)
+        print("geococo.json: {:.1f} MiB".format(os.path.getsize(fpath) / 2 ** 20))
+
+        run("dict", lambda: read_dicts(fpath))
+        run("json", lambda: read_index(CocoIndex.from_json(fpath)))
+        CocoIndex.from_json(fpath).save(index_path(fpath))
+        run("npz", lambda: read_index(CocoIndex.load(index_path(fpath))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark the tile to feature assignment of gen_label.
+
+Compare the former WKB keyed lookup with the position based FeatureIndex on
+synthetic square polygons, e.g.
+
+    python benchmark/feature_index.py --num 1000000 --zoom 14
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from shapely.geometry import box
+
+from ohsome2label.spatial import SHAPELY_2, FeatureIndex
+from ohsome2label.tile import Bbox, get_bbox, tiles
+
+BBOX = Bbox(8.625, 49.3711, 8.7334, 49.4397)
+
+
+def synthetic_features(num, seed=0):
+    """Generate geojson-like features and their geometries"""
+    rnd = random.Random(seed)
+    feats = []
+    geoms = []
+    for i in range(num):
+        x = rnd.uniform(BBOX.west, BBOX.east)
+        y = rnd.uniform(BBOX.south, BBOX.north)
+        geom = box(x, y, x + 0.001, y + 0.001)
+        feats.append({"type": "Feature", "properties": {"label": i % 4}})
+        geoms.append(geom)
+    return feats, geoms
+
+
+def wkb_lookup(feats, geoms, tile_list):
+    """tile assignment as done before, keyed by the WKB of the geometries"""
+    from shapely.strtree import STRtree
+
+    lookup = {}
+    for feat, geom in zip(feats, geoms):
+        lookup[geom.wkb] = feat
+    tree = STRtree(geoms)
+    tile_feats = {}
+    for t in tile_list:
+        r = tree.query(box(*get_bbox(t)))
+        if SHAPELY_2:
+            r = [geoms[i] for i in r]
+        if len(r) != 0:
+            tile_feats[t] = [lookup[g.wkb] for g in r]
+    return tile_feats
+
+
+def index_lookup(feats, geoms, tile_list):
+    """tile assignment by positions into the feature array"""
+    tree = FeatureIndex(geoms)
+    tile_feats = {}
+    for t in tile_list:
+        r = tree.query(box(*get_bbox(t)))
+        if len(r) != 0:
+            tile_feats[t] = r
+    return tile_feats
+
+
+def measure(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num", type=int, default=1000000)
+    parser.add_argument("--zoom", type=int, default=14)
+    args = parser.parse_args()
+
+    feats, geoms = synthetic_features(args.num)
+    tile_list = list(tiles(BBOX, args.zoom))
+    print("{} polygons, {} tiles".format(args.num, len(tile_list)))
+    for name, func in [("wkb", wkb_lookup), ("index", index_lookup)]:
+        elapsed, peak = measure(func, feats, geoms, tile_list)
+        print("{:>6}: {:8.2f}s  peak {:8.1f} MiB".format(name, elapsed, peak / 2 ** 20))
+
+
+if __name__ == "__main__":
+    main()
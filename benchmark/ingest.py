@@ -0,0 +1,99 @@
+"""Benchmark reading training tiles from png directories and packed arrays.
+
+The labelled tiles of a project (default: the example_result project) are
+replicated into --tiles tiles of a temporary workspace, packed with
+export.pack_tiles, and then read in shuffled batches from both layouts, e.g.
+
+    python benchmark/ingest.py --tiles 5000 --batch 32
+
+Reading the pngs opens and decodes two files per tile and maps the label
+colors to class indices, reading the packed arrays copies slices of memory
+maps.
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from ohsome2label.config import Parser, workspace
+from ohsome2label.export import LabelDecoder, PackedTiles, pack_tiles, tile_names
+from ohsome2label.label import geococo
+from ohsome2label.palette import palette
+
+
+def replicate(cfg, src, dst, num):
+    """copy the labelled tiles of src into num tiles of dst"""
+    names = tile_names(src)
+    shutil.copy(os.path.join(src.other, "colors"), os.path.join(dst.other, "colors"))
+    for i in range(num):
+        name = names[i % len(names)] + ".png"
+        new = "{}.{}.0.png".format(cfg.zoom, i)
+        shutil.copy(os.path.join(src.label, name), os.path.join(dst.label, new))
+        shutil.copy(os.path.join(src.img, name), os.path.join(dst.img, new))
+
+
+def read_pngs(ws, decoder, batches):
+    names = [name + ".png" for name in tile_names(ws)]
+    for batch in batches:
+        images = [Image.open(os.path.join(ws.img, names[i])) for i in batch]
+        images = np.stack([np.asarray(im.convert("RGB")) for im in images])
+        labels = [decoder.decode(os.path.join(ws.label, names[i])) for i in batch]
+        yield images, np.stack(labels)
+
+
+def read_packed(packed, batches):
+    for batch in batches:
+        idx = np.sort(batch)
+        yield np.array(packed.images[idx]), np.array(packed.labels[idx])
+
+
+def run(name, batches):
+    start = time.perf_counter()
+    tiles = 0
+    for images, labels in batches:
+        tiles += len(labels)
+    elapsed = time.perf_counter() - start
+    print(
+        "{:>6}: {:6d} tiles {:8.3f}s  {:9.1f} tiles/s".format(
+            name, tiles, elapsed, tiles / elapsed
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--config", default="config/config.yaml")
+    parser.add_argument("--schema", default="config/schema.yaml")
+    parser.add_argument("--tiles", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    cfg = Parser(args.config, args.schema).parse()
+    src = workspace(cfg.workspace)
+    with tempfile.TemporaryDirectory() as tmp:
+        ws = workspace(tmp)
+        replicate(cfg, src, ws, args.tiles)
+
+        start = time.perf_counter()
+        pack_tiles(cfg, ws, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        print("  pack: {:6d} tiles {:8.3f}s".format(args.tiles, elapsed))
+
+        order = list(range(args.tiles))
+        random.Random(0).shuffle(order)
+        batches = [order[i:i + args.batch] for i in range(0, len(order), args.batch)]
+        pal = palette(cfg.tags, os.path.join(ws.other, "colors"))
+        decoder = LabelDecoder(pal, geococo(cfg).catIdxs)
+
+        run("png", read_pngs(ws, decoder, batches))
+        run("packed", read_packed(PackedTiles(ws.export), batches))
+
+
+if __name__ == "__main__":
+    main()
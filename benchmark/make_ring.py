@@ -0,0 +1,86 @@
+"""Benchmark the ring assembly of overpass relations.
+
+Split a circle into shuffled, partly reversed way fragments and join them
+again with overpass.make_ring, e.g.
+
+    python benchmark/make_ring.py --fragments 10000
+
+The former nested loop assembly is quadratic, it is only run on the first
+--legacy fragments.
+"""
+import argparse
+import math
+import random
+import time
+
+from ohsome2label.overpass import make_ring
+
+
+def legacy_make_ring(parts):
+    """single pass nested loop assembly used before"""
+    for j, other in enumerate(parts):
+        if other == []:
+            continue
+        for i, part in enumerate(parts):
+            if part == [] or part == other:
+                continue
+            if part[-1] == other[0]:
+                part.extend(other[1:])
+                other.clear()
+                break
+            elif part[-1] == other[-1]:
+                part.extend(other[-2::-1])
+                other.clear()
+                break
+            elif part[0] == other[0]:
+                part[0:0] = other[-1:0:-1]
+                other.clear()
+                break
+            elif part[0] == other[-1]:
+                part[0:0] = other[:-1]
+                other.clear()
+                break
+    return [part for part in parts if part != []]
+
+
+def fragments(num, vertices=5, seed=0):
+    """split a circle into num shuffled fragments"""
+    total = num * (vertices - 1)
+    coords = [
+        (math.cos(2 * math.pi * i / total), math.sin(2 * math.pi * i / total))
+        for i in range(total)
+    ]
+    coords.append(coords[0])
+    parts = [
+        coords[i:i + vertices] for i in range(0, total, vertices - 1)
+    ]
+    rnd = random.Random(seed)
+    rnd.shuffle(parts)
+    return [part[::-1] if rnd.random() < 0.5 else part for part in parts]
+
+
+def run(name, func, parts):
+    start = time.perf_counter()
+    rings = func([list(part) for part in parts])
+    elapsed = time.perf_counter() - start
+    closed = sum(1 for ring in rings if ring[0] == ring[-1])
+    print(
+        "{:>6}: {:6d} fragments {:8.3f}s  {} rings, {} closed".format(
+            name, len(parts), elapsed, len(rings), closed
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fragments", type=int, default=10000)
+    parser.add_argument("--legacy", type=int, default=2000)
+    args = parser.parse_args()
+
+    run("hashed", make_ring, fragments(args.fragments))
+    if args.legacy:
+        run("legacy", legacy_make_ring, fragments(args.legacy))
+
+
+if __name__ == "__main__":
+    main()
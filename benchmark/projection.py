@@ -0,0 +1,58 @@
+"""Benchmark the scalar and the array projection of polygon rings.
+
+Project a ring from EPSG:4326 to the pixel coordinates of a tile, e.g.
+
+    python benchmark/projection.py --vertices 10000
+"""
+import argparse
+import math
+import timeit
+
+import numpy as np
+
+from ohsome2label.tile import (
+    Tile,
+    apply_transform,
+    apply_transform_array,
+    tile_get_transform,
+    xy,
+    xy_array,
+)
+
+
+def make_ring(vertices):
+    """ring around Heidelberg with the given number of vertices"""
+    angles = np.linspace(0, 2 * math.pi, vertices)
+    lon = 8.68 + 0.01 * np.cos(angles)
+    lat = 49.41 + 0.01 * np.sin(angles)
+    return list(zip(lon.tolist(), lat.tolist()))
+
+
+def scalar(ring, trans):
+    return apply_transform([xy(*coord) for coord in ring], trans)
+
+
+def vectorised(ring, trans):
+    ring = np.asarray(ring)
+    x, y = xy_array(ring[:, 0], ring[:, 1])
+    return apply_transform_array(np.column_stack((x, y)), trans)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vertices", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    ring = make_ring(args.vertices)
+    trans = tile_get_transform(Tile(8586, 5597, 14))
+    assert np.allclose(scalar(ring, trans), vectorised(ring, trans))
+    for name, func in [("scalar", scalar), ("array", vectorised)]:
+        best = min(
+            timeit.repeat(lambda: func(ring, trans), number=1, repeat=args.repeat)
+        )
+        print("{:>6}: {:8.3f} ms".format(name, best * 1000))
+
+
+if __name__ == "__main__":
+    main()
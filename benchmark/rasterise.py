@@ -0,0 +1,87 @@
+"""Benchmark the label rasteriser backends.
+
+Burn tiles of random overlapping polygons with holes with both burn_tile
+backends, e.g.
+
+    python benchmark/rasterise.py --tiles 200 --polygons 50 --mode palette
+
+The pil backend draws the exteriors one by one, the numpy backend burns all
+polygons into class indices at once and encodes once. --mode selects rgb
+or single channel palette / grayscale pngs.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from shapely.affinity import rotate
+from shapely.geometry import Point
+
+from ohsome2label.label import burn_tile
+from ohsome2label.palette import palette
+
+
+def polygons(num, labels, seed=0, size=256):
+    """random polygons with a hole, in pixel coordinates"""
+    rnd = random.Random(seed)
+    geoms = []
+    for _ in range(num):
+        x, y = rnd.uniform(0, size), rnd.uniform(0, size)
+        r = rnd.uniform(5, size / 4)
+        outer = Point(x, y).buffer(r, resolution=rnd.randint(2, 16))
+        outer = rotate(outer, rnd.uniform(0, 90))
+        geoms.append((outer.difference(Point(x, y).buffer(r / 3)), rnd.choice(labels)))
+    return geoms
+
+
+def run(name, tiles, pal, catIdxs, out_dir, mode):
+    start = time.perf_counter()
+    for i, geoms in enumerate(tiles):
+        fname = os.path.join(out_dir, "{}.{}.png".format(name, i))
+        list(
+            burn_tile(
+                geoms,
+                "segmentation",
+                pal,
+                fname,
+                backend=name,
+                catIdxs=catIdxs,
+                mode=mode,
+            )
+        )
+    elapsed = time.perf_counter() - start
+    size = sum(
+        os.path.getsize(os.path.join(out_dir, f))
+        for f in os.listdir(out_dir)
+        if f.startswith(name + ".")
+    )
+    print(
+        "{:>6}: {:5d} tiles {:8.3f}s  {:8.1f} tiles/s  {:8.1f} KiB".format(
+            name, len(tiles), elapsed, len(tiles) / elapsed, size / 1024
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tiles", type=int, default=200)
+    parser.add_argument("--polygons", type=int, default=50)
+    parser.add_argument(
+        "--mode", choices=["rgb", "palette", "grayscale"], default="rgb"
+    )
+    args = parser.parse_args()
+
+    labels = ["urban", "industry", "water"]
+    catIdxs = {label: i + 1 for i, label in enumerate(labels)}
+    tiles = [polygons(args.polygons, labels, seed=i) for i in range(args.tiles)]
+    with tempfile.TemporaryDirectory() as out_dir:
+        pal = palette(
+            [{"label": label} for label in labels], os.path.join(out_dir, "colors")
+        )
+        for name in ("pil", "numpy"):
+            run(name, tiles, pal, catIdxs, out_dir, args.mode)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,17 @@
 __version__ = '1.1.2'
 from .config import *
 from .utils import *
+from .spatial import *
 from .label import *
 from .tile import *
 from .visualize import *
 from .palette import palette
 from .overpass import *
+from .raster import *
+from .reader import *
+from .store import *
+from .tilecache import *
+from .tfrecord import *
+from .coco import *
+from .export import *
 from .quality import *
@@ -0,0 +1,243 @@
+"""
+Array backed index of a coco annotation file.
+The images, annotations and categories of geococo.json are streamed with the
+incremental reader and kept in numpy columns instead of one dict per object:
+ids, sizes, bboxes and areas as arrays, the polygon coordinates of all
+segmentations in one flat float buffer with offsets. The annotations are
+ordered by image, so the annotations of an image are one slice found by its
+position, there is no per image list or lookup like pycocotools builds.
+The index can be saved next to the coco file as .npz and loaded from there
+without parsing the json again.
+"""
+import os
+from array import array
+
+import numpy as np
+
+from ohsome2label.reader import iter_arrays, read_chunks
+
+INDEX_EXT = ".npz"
+
+
+def index_path(fpath):
+    """get the path of the saved index of a coco file"""
+    return os.path.splitext(fpath)[0] + INDEX_EXT
+
+
+class CocoIndex(object):
+    """Columns of the images, annotations and categories of a coco file
+
+    Images, in the order of the file:
+        image_ids, widths, heights, file_names
+        image_offsets: annotations of image i are image_offsets[i] to
+            image_offsets[i + 1]
+    Annotations, ordered by image:
+        ann_ids, ann_image_ids, category_ids, bboxes (n, 4), areas, iscrowd
+        seg_offsets: polygons of annotation j are seg_offsets[j] to
+            seg_offsets[j + 1]
+        poly_offsets: coordinates of polygon k are coords[poly_offsets[k]]
+            to coords[poly_offsets[k + 1]], x and y interleaved
+    Categories:
+        cat_ids, cat_names
+    """
+
+    def __init__(self, columns):
+        for key, value in columns.items():
+            setattr(self, key, value)
+        self._image_pos = {int(i): pos for pos, i in enumerate(self.image_ids)}
+        self._cat_names = dict(zip(self.cat_ids.tolist(), self.cat_names))
+
+    @classmethod
+    def from_json(cls, fpath):
+        """Build the index by streaming a coco file
+
+        :param fpath: path of the coco json file
+        """
+        image_ids, widths, heights = array("q"), array("q"), array("q")
+        file_names = []
+        cat_ids, cat_names = array("q"), []
+        ann_ids, ann_image_ids, category_ids = array("q"), array("q"), array("q")
+        bboxes, areas, iscrowd = array("d"), array("d"), array("b")
+        seg_counts, poly_offsets, coords = array("q"), array("q", [0]), array("d")
+
+        with open(fpath, encoding="utf-8") as f:
+            keys = ("images", "annotations", "categories")
+            for key, value in iter_arrays(read_chunks(f), keys):
+                if key == "images":
+                    image_ids.append(value["id"])
+                    widths.append(value["width"])
+                    heights.append(value["height"])
+                    file_names.append(value["file_name"])
+                elif key == "categories":
+                    cat_ids.append(value["id"])
+                    cat_names.append(value["name"])
+                else:
+                    ann_ids.append(value["id"])
+                    ann_image_ids.append(value["image_id"])
+                    category_ids.append(value["category_id"])
+                    bboxes.extend(value["bbox"])
+                    areas.append(value.get("area", 0.0))
+                    iscrowd.append(value.get("iscrowd", 0))
+                    seg = value.get("segmentation")
+                    # run length encoded masks are not kept
+                    polygons = seg if isinstance(seg, list) else []
+                    seg_counts.append(len(polygons))
+                    for polygon in polygons:
+                        coords.extend(polygon)
+                        poly_offsets.append(len(coords))
+
+        columns = {
+            "image_ids": np.frombuffer(image_ids, dtype=np.int64),
+            "widths": np.frombuffer(widths, dtype=np.int64),
+            "heights": np.frombuffer(heights, dtype=np.int64),
+            "file_names": np.array(file_names, dtype=str),
+            "cat_ids": np.frombuffer(cat_ids, dtype=np.int64),
+            "cat_names": np.array(cat_names, dtype=str),
+            "ann_ids": np.frombuffer(ann_ids, dtype=np.int64),
+            "ann_image_ids": np.frombuffer(ann_image_ids, dtype=np.int64),
+            "category_ids": np.frombuffer(category_ids, dtype=np.int64),
+            "bboxes": np.frombuffer(bboxes, dtype=np.float64).reshape(-1, 4),
+            "areas": np.frombuffer(areas, dtype=np.float64),
+            "iscrowd": np.frombuffer(iscrowd, dtype=np.int8),
+            "seg_offsets": np.concatenate(
+                ([0], np.cumsum(np.frombuffer(seg_counts, dtype=np.int64)))
+            ),
+            "poly_offsets": np.frombuffer(poly_offsets, dtype=np.int64),
+            "coords": np.frombuffer(coords, dtype=np.float64),
+        }
+        return cls(_group_by_image(columns))
+
+    @classmethod
+    def load(cls, fpath):
+        """Load an index saved with save"""
+        with np.load(fpath) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def save(self, fpath):
+        """Save the index as .npz"""
+        tmp_path = fpath + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **{key: getattr(self, key) for key in _COLUMNS})
+        os.replace(tmp_path, fpath)
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def position(self, image_id):
+        """get the position of an image by its id"""
+        return self._image_pos[image_id]
+
+    def annotations(self, i):
+        """get the slice of the annotations of the image at position i"""
+        return slice(int(self.image_offsets[i]), int(self.image_offsets[i + 1]))
+
+    def image(self, i):
+        """get the coco image dict of the image at position i"""
+        return {
+            "id": int(self.image_ids[i]),
+            "width": int(self.widths[i]),
+            "height": int(self.heights[i]),
+            "file_name": str(self.file_names[i]),
+        }
+
+    def category_name(self, cat_id):
+        """get the name of a category by its id"""
+        return self._cat_names[cat_id]
+
+    def segmentation(self, j):
+        """get the polygons of annotation j as (n, 2) arrays"""
+        polys = self.poly_offsets[self.seg_offsets[j] : self.seg_offsets[j + 1] + 1]
+        return [
+            self.coords[start:end].reshape(-1, 2)
+            for start, end in zip(polys[:-1], polys[1:])
+        ]
+
+    def annotation(self, j):
+        """get the coco annotation dict of annotation j"""
+        return {
+            "id": int(self.ann_ids[j]),
+            "image_id": int(self.ann_image_ids[j]),
+            "category_id": int(self.category_ids[j]),
+            "bbox": self.bboxes[j].tolist(),
+            "area": float(self.areas[j]),
+            "iscrowd": int(self.iscrowd[j]),
+            "segmentation": [p.ravel().tolist() for p in self.segmentation(j)],
+        }
+
+
+_COLUMNS = (
+    "image_ids",
+    "widths",
+    "heights",
+    "file_names",
+    "image_offsets",
+    "cat_ids",
+    "cat_names",
+    "ann_ids",
+    "ann_image_ids",
+    "category_ids",
+    "bboxes",
+    "areas",
+    "iscrowd",
+    "seg_offsets",
+    "poly_offsets",
+    "coords",
+)
+
+
+def _group_by_image(columns):
+    """order the annotations by the position of their image and add the
+    image_offsets, annotations of unknown images are dropped"""
+    pos = {int(i): p for p, i in enumerate(columns["image_ids"])}
+    ann_pos = np.array(
+        [pos.get(i, -1) for i in columns["ann_image_ids"].tolist()], dtype=np.int64
+    )
+    keep = ann_pos >= 0
+    order = np.argsort(ann_pos, kind="stable")
+    order = order[keep[order]]
+    # geococo.json is written image by image, so this is usually a no-op
+    if len(order) != len(ann_pos) or np.any(np.diff(order) < 0):
+        seg_offsets = columns["seg_offsets"]
+        poly_offsets = columns["poly_offsets"]
+        polys = _gather_ranges(seg_offsets[:-1][order], seg_offsets[1:][order])
+        coords = _gather_ranges(poly_offsets[:-1][polys], poly_offsets[1:][polys])
+        counts = (seg_offsets[1:] - seg_offsets[:-1])[order]
+        lengths = (poly_offsets[1:] - poly_offsets[:-1])[polys]
+        for key in ("ann_ids", "ann_image_ids", "category_ids", "bboxes", "areas"):
+            columns[key] = columns[key][order]
+        columns["iscrowd"] = columns["iscrowd"][order]
+        columns["seg_offsets"] = np.concatenate(([0], np.cumsum(counts)))
+        columns["poly_offsets"] = np.concatenate(([0], np.cumsum(lengths)))
+        columns["coords"] = columns["coords"][coords]
+    ann_pos = ann_pos[order]
+    columns["image_offsets"] = np.searchsorted(
+        ann_pos, np.arange(len(columns["image_ids"]) + 1)
+    )
+    return columns
+
+
+def _gather_ranges(starts, ends):
+    """get the indexes of the concatenated ranges start to end"""
+    counts = ends - starts
+    total = int(counts.sum())
+    first = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return first + np.arange(total, dtype=np.int64)
+
+
+def read_coco(fpath, save=False):
+    """Get the index of a coco file, from its saved index if it is up to
+    date, otherwise the index is built from the json
+
+    :param fpath: path of the coco json file
+    :param save: save a built index next to the coco file
+    :return: CocoIndex
+    """
+    ipath = index_path(fpath)
+    if os.path.exists(ipath) and (
+        not os.path.exists(fpath) or os.path.getmtime(ipath) >= os.path.getmtime(fpath)
+    ):
+        return CocoIndex.load(ipath)
+    index = CocoIndex.from_json(fpath)
+    if save:
+        index.save(ipath)
+    return index
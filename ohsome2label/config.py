@@ -96,6 +96,11 @@ class o2l_config(Config):
     def types(self):
         return self.get_property("osm", "types")
 
+    @property
+    def combine(self):
+        """download all tags by one ohsome request"""
+        return bool(self.get_property("osm", "combine"))
+
     @property
     def img_api(self):
         """get image api"""
@@ -116,6 +121,16 @@ class o2l_config(Config):
         """get zoom level"""
         return self.get_property("image", "zoom")
 
+    @property
+    def backend(self):
+        """get rasteriser of the label tiles"""
+        return self.get_property("label", "backend") or "pil"
+
+    @property
+    def mode(self):
+        """get color mode of the label tiles"""
+        return self.get_property("label", "mode") or "rgb"
+
     @property
     def tiles(self):
         bboxes = self.get_property("osm", "bboxes")
@@ -156,6 +171,7 @@ class workspace(object):
         self.other = os.path.join(self.workspace, "other")
         self.label = os.path.join(self.workspace, "labels")
         self.preview = os.path.join(self.workspace, "preview")
+        self.export = os.path.join(self.workspace, "export")
         self.raw = os.path.join(self.other, "raw")
         self.tmp = os.path.join(self.other, "tmp")
         self.tile = os.path.join(self.other, "tile")
@@ -0,0 +1,469 @@
+"""
+Export the labelled tiles for training.
+The label masks and the imagery are packed into fixed shape uint8 .npy
+arrays, together with an array of the (z, x, y) of every tile. The arrays
+are written through memory maps, so memory does not grow with the number of
+tiles, and are read back as memory maps, so loaders slice them without
+decoding a png or touching one file per tile.
+Alternatively the coco images and annotations are streamed into size
+balanced TFRecord or tar (WebDataset) shards with a train/val split by the
+hash of the tile name. The image files are read into the shards one record
+at a time, they are never copied.
+"""
+import hashlib
+import heapq
+import io
+import json
+import os
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image
+from tqdm import tqdm
+
+from ohsome2label.label import geococo, nx, ny
+from ohsome2label.palette import palette
+from ohsome2label.raster import hex_to_rgb
+from ohsome2label.reader import iter_arrays, read_chunks
+from ohsome2label.tfrecord import (
+    bytes_feature,
+    encode_example,
+    float_feature,
+    fast_checksums,
+    int64_feature,
+    open_writer,
+)
+
+PACKED_LABELS = "labels.npy"
+PACKED_IMAGES = "images.npy"
+PACKED_TILES = "tiles.npy"
+PACKED_META = "packed.json"
+SHARD_MANIFEST = "shards.json"
+SHARD_EXT = {"tfrecord": ".tfrecord", "tar": ".tar"}
+
+
+def tile_names(workspace):
+    """get the names of the labelled tiles in tile order"""
+    names = [f[:-4] for f in os.listdir(workspace.label) if f.endswith(".png")]
+    return sorted(names, key=lambda name: [int(c) for c in name.split(".")])
+
+
+def image_path(workspace, name):
+    """get the path of the image of a tile, None if it is not downloaded"""
+    for directory in (workspace.img, workspace.tmp):
+        for ext in (".png", ".jpg", ".tiff"):
+            fpath = os.path.join(directory, name + ext)
+            if os.path.exists(fpath):
+                return fpath
+    return None
+
+
+class LabelDecoder(object):
+    """Decode label pngs of any mode into class indices
+
+    :param pal: palette of the labels
+    :param catIdxs: label -> class index
+    """
+
+    def __init__(self, pal, catIdxs):
+        colors = {}
+        for label, idx in catIdxs.items():
+            r, g, b = hex_to_rgb(pal.color(label))
+            colors[(r << 16) | (g << 8) | b] = idx
+        self._keys = np.array(sorted(colors), dtype=np.int64)
+        self._idxs = np.array([colors[k] for k in self._keys], dtype=np.uint8)
+
+    def decode(self, fpath):
+        """get the (ny, nx) uint8 class indices of a label png"""
+        im = Image.open(fpath)
+        if im.mode in ("P", "L"):
+            return np.asarray(im, dtype=np.uint8)
+        rgb = np.asarray(im.convert("RGB"), dtype=np.int64)
+        keys = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+        # unknown colors, e.g. the background, are class 0
+        pos = np.clip(np.searchsorted(self._keys, keys), 0, len(self._keys) - 1)
+        found = self._keys[pos] == keys
+        return np.where(found, self._idxs[pos], 0).astype(np.uint8)
+
+
+def pack_tiles(cfg, workspace, out_dir=None, images=True, workers=1):
+    """Pack label masks and imagery into memory mappable arrays
+
+    :param cfg: ohsome2label config
+    :param workspace: workspace
+    :param out_dir: output directory, defaults to workspace.export
+    :param images: also pack the imagery, tiles without image are left black
+    :param workers: number of threads decoding the pngs
+    :return: number of packed tiles
+    """
+    out_dir = out_dir or workspace.export
+    os.makedirs(out_dir, exist_ok=True)
+    names = tile_names(workspace)
+    if not names:
+        print("No labelled tiles to pack, please run label first.")
+        return 0
+    coco = geococo(cfg)
+    pal = palette(cfg.tags, os.path.join(workspace.other, "colors"))
+    decoder = LabelDecoder(pal, coco.catIdxs)
+    img_paths = [image_path(workspace, name) for name in names]
+    images = images and any(img_paths)
+
+    tiles = np.array(
+        [[int(c) for c in name.split(".")] for name in names], dtype=np.int32
+    ).reshape(-1, 3)
+    np.save(os.path.join(out_dir, PACKED_TILES), tiles)
+    labels = np.lib.format.open_memmap(
+        os.path.join(out_dir, PACKED_LABELS), "w+", np.uint8, (len(names), ny, nx)
+    )
+    if images:
+        imgs = np.lib.format.open_memmap(
+            os.path.join(out_dir, PACKED_IMAGES),
+            "w+",
+            np.uint8,
+            (len(names), ny, nx, 3),
+        )
+
+    def _decode(i):
+        label = decoder.decode(os.path.join(workspace.label, names[i] + ".png"))
+        img = None
+        if images and img_paths[i] is not None:
+            img = np.asarray(Image.open(img_paths[i]).convert("RGB"), dtype=np.uint8)
+        return label, img
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_decode, range(len(names)))
+        for i, (label, img) in tqdm(enumerate(results), total=len(names)):
+            labels[i] = label
+            if img is not None:
+                imgs[i] = img
+    labels.flush()
+    del labels
+    if images:
+        imgs.flush()
+        del imgs
+
+    missing = []
+    if images:
+        missing = [name for name, path in zip(names, img_paths) if path is None]
+    meta = {
+        "tiles": len(names),
+        "width": nx,
+        "height": ny,
+        "images": bool(images),
+        "missing_images": missing,
+        "categories": coco.cats,
+    }
+    with open(os.path.join(out_dir, PACKED_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    return len(names)
+
+
+class PackedTiles(object):
+    """Read packed tiles as memory maps
+
+    :param root: directory of the packed arrays
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, PACKED_META), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.tiles = np.load(os.path.join(root, PACKED_TILES))
+        self.labels = np.load(os.path.join(root, PACKED_LABELS), mmap_mode="r")
+        self.images = None
+        if self.meta["images"]:
+            self.images = np.load(os.path.join(root, PACKED_IMAGES), mmap_mode="r")
+        self._names = {
+            "{}.{}.{}".format(*tile): i for i, tile in enumerate(self.tiles.tolist())
+        }
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __getitem__(self, i):
+        """get (image, label) views of tile i, or of a slice of tiles"""
+        image = None if self.images is None else self.images[i]
+        return image, self.labels[i]
+
+    def index(self, name):
+        """get the position of a tile by its "z.x.y" name"""
+        return self._names[name]
+
+
+def split_of(name, val_fraction):
+    """get the split of a tile by the hash of its name, the split does not
+    change when tiles are added or removed"""
+    h = int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:8], 16) / 2 ** 32
+    return "val" if h < val_fraction else "train"
+
+
+def balance_shards(sizes, num):
+    """Assign items to shards of about equal size, largest item first to the
+    currently smallest shard
+
+    :param sizes: size of every item
+    :param num: number of shards
+    :return: shard index of every item
+    """
+    heap = [(0, i) for i in range(num)]
+    shards = [0] * len(sizes)
+    for pos in sorted(range(len(sizes)), key=lambda p: (-sizes[p], p)):
+        load, i = heapq.heappop(heap)
+        shards[pos] = i
+        heapq.heappush(heap, (load + sizes[pos], i))
+    return shards
+
+
+def split_shards(sizes, counts, num):
+    """Spread shards over the splits, every next shard goes to the split with
+    the currently largest shards. Every split gets at least one shard and at
+    most one per tile, otherwise the shards add up to num.
+
+    :param sizes: size of every split
+    :param counts: number of tiles of every split
+    :param num: number of shards
+    :return: number of shards of every split
+    """
+    nums = [1] * len(sizes)
+    for _ in range(num - len(sizes)):
+        splits = [i for i in range(len(sizes)) if nums[i] < counts[i]]
+        if not splits:
+            break
+        i = max(splits, key=lambda i: (sizes[i] / nums[i], -i))
+        nums[i] += 1
+    return nums
+
+
+def iter_coco(fpath, keys=("images", "annotations")):
+    """Yield (key, element) of the images and annotations of a coco file one
+    by one"""
+    with open(fpath, encoding="utf-8") as f:
+        for key, value in iter_arrays(read_chunks(f), keys):
+            yield key, value
+
+
+def tf_example(img, annos, cats, image, label):
+    """Encode a coco image and its annotations as tf.train.Example, in the
+    layout of the tensorflow object detection api
+
+    :param img: coco image with "path" of the image file
+    :param annos: coco annotations of the image
+    :param cats: category id -> name
+    :param image: bytes of the image file
+    :param label: bytes of the label png, None if there is none
+    """
+    w, h = float(img["width"]), float(img["height"])
+    xmin, xmax, ymin, ymax = [], [], [], []
+    for anno in annos:
+        # geococo bbox is [max x, max y, min x, min y]
+        x0, y0, x1, y1 = anno["bbox"]
+        xmin.append(min(x0, x1) / w)
+        xmax.append(max(x0, x1) / w)
+        ymin.append(min(y0, y1) / h)
+        ymax.append(max(y0, y1) / h)
+    ext = os.path.splitext(img["path"])[1].lstrip(".").lower()
+    features = {
+        "image/height": int64_feature(img["height"]),
+        "image/width": int64_feature(img["width"]),
+        "image/filename": bytes_feature(img["file_name"].encode("utf-8")),
+        "image/source_id": bytes_feature(str(img["id"]).encode("utf-8")),
+        "image/encoded": bytes_feature(image),
+        "image/format": bytes_feature(("jpeg" if ext == "jpg" else ext).encode()),
+        "image/object/bbox/xmin": float_feature(xmin),
+        "image/object/bbox/xmax": float_feature(xmax),
+        "image/object/bbox/ymin": float_feature(ymin),
+        "image/object/bbox/ymax": float_feature(ymax),
+        "image/object/area": float_feature([float(a["area"]) for a in annos]),
+        "image/object/class/label": int64_feature(
+            [a["category_id"] for a in annos]
+        ),
+        "image/object/class/text": bytes_feature(
+            [cats[a["category_id"]].encode("utf-8") for a in annos]
+        ),
+    }
+    if label is not None:
+        features["image/segmentation/class/encoded"] = bytes_feature(label)
+        features["image/segmentation/class/format"] = bytes_feature(b"png")
+    return encode_example(features)
+
+
+def _add_member(tar, name, f, size):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = 0o644
+    tar.addfile(info, f)
+
+
+def _write_shard(job):
+    """Write one shard
+
+    :param job: (format, shard path, images, annotation spool path, categories)
+    :return: (shard path, number of records, number of bytes)
+    """
+    fmt, path, imgs, spool, cats = job
+    annos = {}
+    with open(spool, encoding="utf-8") as f:
+        for line in f:
+            anno = json.loads(line)
+            annos.setdefault(anno["image_id"], []).append(anno)
+
+    tmp_path = path + ".part"
+    if fmt == "tfrecord":
+        with open_writer(tmp_path) as out:
+            for img in imgs:
+                with open(img["path"], "rb") as f:
+                    image = f.read()
+                label = None
+                if img["label"] is not None:
+                    with open(img["label"], "rb") as f:
+                        label = f.read()
+                example = tf_example(img, annos.get(img["id"], []), cats, image, label)
+                out.write(example)
+    else:
+        with tarfile.open(tmp_path, "w") as tar:
+            for img in imgs:
+                # webdataset groups the members of a sample by the name up to
+                # the first dot
+                key = os.path.splitext(img["file_name"])[0].replace(".", "_")
+                ext = os.path.splitext(img["path"])[1].lower()
+                with open(img["path"], "rb") as f:
+                    _add_member(tar, key + ext, f, os.path.getsize(img["path"]))
+                if img["label"] is not None:
+                    with open(img["label"], "rb") as f:
+                        size = os.path.getsize(img["label"])
+                        _add_member(tar, key + ".label.png", f, size)
+                meta = {
+                    k: v for k, v in img.items() if k not in ("path", "label", "size")
+                }
+                sample = {"image": meta, "annotations": annos.get(img["id"], [])}
+                data = json.dumps(sample).encode("utf-8")
+                _add_member(tar, key + ".json", io.BytesIO(data), len(data))
+    os.replace(tmp_path, path)
+    return path, len(imgs), os.path.getsize(path)
+
+
+def export_shards(
+    workspace, fmt="tfrecord", out_dir=None, shards=4, val_fraction=0.2, workers=1
+):
+    """Stream the coco images and annotations into train/val shards
+
+    :param workspace: workspace
+    :param fmt: "tfrecord" or "tar" (WebDataset)
+    :param out_dir: output directory, defaults to workspace.export
+    :param shards: number of shards, split between train and val by size,
+        both splits get at least one shard
+    :param val_fraction: fraction of the tiles in the val split
+    :param workers: number of processes writing shards
+    :return: list of (shard path, number of records, number of bytes)
+    """
+    out_dir = out_dir or workspace.export
+    os.makedirs(out_dir, exist_ok=True)
+    cocoPath = os.path.join(workspace.anno, "geococo.json")
+
+    # images are small, only their annotations are streamed to the shards
+    imgs = {}
+    cats = {}
+    missing = 0
+    for key, img in iter_coco(cocoPath, ("images", "categories")):
+        if key == "categories":
+            cats[img["id"]] = img["name"]
+            continue
+        name = os.path.splitext(img["file_name"])[0]
+        img["path"] = image_path(workspace, name)
+        if img["path"] is None:
+            missing += 1
+            continue
+        img["label"] = os.path.join(workspace.label, img["file_name"])
+        if not os.path.exists(img["label"]):
+            img["label"] = None
+        img["size"] = os.path.getsize(img["path"])
+        if img["label"] is not None:
+            img["size"] += os.path.getsize(img["label"])
+        img["split"] = split_of(name, val_fraction)
+        imgs[img["id"]] = img
+    if missing:
+        print("{} images are not downloaded and not exported".format(missing))
+    if not imgs:
+        print("No images to export, please run label and image first.")
+        return []
+
+    # shards are spread over the splits by size, then filled largest first
+    splits = []
+    for split in ("train", "val"):
+        members = [img for img in imgs.values() if img["split"] == split]
+        if members:
+            splits.append((split, members))
+    nums = split_shards(
+        [sum(img["size"] for img in members) for _, members in splits],
+        [len(members) for _, members in splits],
+        shards,
+    )
+    groups = []
+    for (split, members), num in zip(splits, nums):
+        assign = balance_shards([img["size"] for img in members], num)
+        for i in range(num):
+            path = os.path.join(
+                out_dir, "{}-{:05d}-of-{:05d}{}".format(split, i, num, SHARD_EXT[fmt])
+            )
+            shard_imgs = [img for img, s in zip(members, assign) if s == i]
+            shard_imgs.sort(key=lambda img: img["id"])
+            for img in shard_imgs:
+                img["shard"] = len(groups)
+            groups.append((split, path, shard_imgs))
+
+    if fmt == "tfrecord" and not fast_checksums():
+        print(
+            "crc32c is not installed, the TFRecord checksums are computed in "
+            "python, which is slow: pip install ohsome2label[tfrecord]"
+        )
+    with tempfile.TemporaryDirectory(dir=out_dir) as spool_dir:
+        spools = [
+            os.path.join(spool_dir, "{}.jsonl".format(i)) for i in range(len(groups))
+        ]
+        handles = [open(spool, "w", encoding="utf-8") for spool in spools]
+        try:
+            for _, anno in iter_coco(cocoPath, ("annotations",)):
+                img = imgs.get(anno["image_id"])
+                if img is not None:
+                    handles[img["shard"]].write(json.dumps(anno) + "\n")
+        finally:
+            for handle in handles:
+                handle.close()
+
+        jobs = [
+            (fmt, path, shard_imgs, spool, cats)
+            for (_, path, shard_imgs), spool in zip(groups, spools)
+        ]
+        if workers > 1:
+            with Pool(workers) as pool:
+                results = list(
+                    tqdm(pool.imap(_write_shard, jobs), total=len(jobs))
+                )
+        else:
+            results = [_write_shard(job) for job in tqdm(jobs)]
+
+    manifest = {
+        "format": fmt,
+        "val_fraction": val_fraction,
+        "categories": [{"id": k, "name": v} for k, v in sorted(cats.items())],
+        "shards": [
+            {
+                "split": split,
+                "file": os.path.basename(path),
+                "records": count,
+                "bytes": size,
+            }
+            for (split, _, _), (path, count, size) in zip(groups, results)
+        ],
+    }
+    with open(os.path.join(out_dir, SHARD_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(
+        "Exported {} tiles into {} shards".format(
+            sum(count for _, count, _ in results), len(results)
+        )
+    )
+    return results
@@ -1,21 +1,48 @@
+import hashlib
 import json
 import os
+import pickle
+import shutil
+import tempfile
 from datetime import datetime
+from multiprocessing import Pool
 
 import geojson
 from geojson import FeatureCollection
+import numpy as np
 from PIL import Image, ImageDraw
-from shapely.geometry import MultiPolygon, Polygon, box, shape
-from shapely.strtree import STRtree
+from shapely.affinity import affine_transform
+from shapely.geometry import Polygon, box
+from shapely.ops import transform
 from tqdm import tqdm
 
 from ohsome2label.palette import palette
-from ohsome2label.tile import Bbox, apply_transform, get_bbox, tile_get_transform, xy
-from ohsome2label.utils import get_area
+from ohsome2label.raster import (
+    burn_outlines,
+    burn_polygons,
+    color_lut,
+    save_label,
+)
+from ohsome2label.spatial import FeatureIndex
+from ohsome2label.store import read_features, store_path
+from ohsome2label.tile import (
+    Bbox,
+    Tile,
+    apply_transform_array,
+    get_xy_bbox,
+    tile_get_transform,
+    west_north,
+    xy_array,
+)
+from ohsome2label.utils import file_hash, get_area
 
 nx = 256
 ny = 256
 
+# cache of the tile index in workspace.other
+INDEX_CACHE = "label_index.pkl"
+# record of labelled tiles in workspace.other
+LABEL_MANIFEST = "label_manifest.jsonl"
 
 class TaskError(Exception):
     """Wrong task"""
@@ -55,6 +82,18 @@ def expolde_multipolygon(multipoly):
     return coords_list
 
 
+def project_ring(ring, trans):
+    """project a wgs84 ring to image-based coordinate system
+
+    :param ring: wgs84 coordinates of the ring
+    :param trans: translation to get image-based coordinate system coordinate
+    :return: (n, 2) array
+    """
+    ring = np.asarray(ring, dtype=float)
+    x, y = xy_array(ring[:, 0], ring[:, 1])
+    return apply_transform_array(np.column_stack((x, y)), trans)
+
+
 def parse_polygon(coordinates, trans, nx=256, ny=256):
     """parse polygon
 
@@ -63,54 +102,56 @@ def parse_polygon(coordinates, trans, nx=256, ny=256):
     :param nx: image width
     :param ny: image length
     """
-    exterior = coordinates[0]
-    exterior = [xy(*coord) for coord in exterior]
-    exterior = apply_transform(exterior, trans)
-
-    if len(coordinates) > 1:
-        interiors = coordinates[1:]
-        interiors = [[xy(*coord) for coord in interior] for interior in interiors]
-        interiors = [apply_transform(interior, trans) for interior in interiors]
-    else:
-        interiors = []
+    exterior = project_ring(coordinates[0], trans)
+    interiors = [project_ring(interior, trans) for interior in coordinates[1:]]
 
     return Polygon(exterior, interiors).buffer(0)
 
 
+def to_mercator(geom):
+    """project a wgs84 shapely geometry to EPSG:3857, polygonal geometries are
+       cleaned with buffer(0)
+
+    :param geom: shapely geometry in wgs84
+    """
+    geom = transform(xy_array, geom)
+    if geom.geom_type in ("Polygon", "MultiPolygon"):
+        geom = geom.buffer(0)
+    return geom
+
+
+def transform_matrix(trans):
+    """convert geoTransform to shapely affine transformation matrix
+
+    :param trans: translation to get image-based coordinate system coordinate
+    """
+    return [
+        1 / trans[1],
+        0,
+        0,
+        1 / trans[5],
+        -trans[0] / trans[1],
+        -trans[3] / trans[5],
+    ]
+
+
 def check_topo(feats, tile, nx=256, ny=256):
     """check features geometry, due to coco cannot recognize segmentation with
        holes, return sorted list of (geometry, label) tuple
 
-    :param feats: geojson feature
+    :param feats: (geometry, label) tuple, geometry is in EPSG:3857
     :param tile: tile of the feature
     :param nx: image width
     :param ny: image length
     """
-    trans = tile_get_transform(tile, nx, ny)
-    bbox = box(0, 0, 255, 255)
+    matrix = transform_matrix(tile_get_transform(tile, nx, ny))
+    bbox = box(*get_xy_bbox(tile))
 
     # geoms element is (geometry, label) tuple
     geoms = []
-
-    # construct tile-based coordinate-system shapely geometry
-    idx = 0
-    for feat in feats:
-        idx += 1
-        geometry = feat["geometry"]
-        label = feat["properties"]["label"]
-        if geometry["type"] == "Polygon":
-            coordinates = geometry["coordinates"]
-            poly = parse_polygon(coordinates, trans, nx, ny)
-            geoms.append((poly.area, poly, label))
-        elif feat["geometry"]["type"] == "MultiPolygon":
-            coordinates = geometry["coordinates"]
-            try:
-                poly = MultiPolygon(
-                    [parse_polygon(coords, trans, nx, ny) for coords in coordinates]
-                )
-                geoms.append((poly.area, poly, label))
-            except Exception:
-                assert 0
+    for geom, label in feats:
+        if geom.geom_type in ("Polygon", "MultiPolygon"):
+            geoms.append((geom.area, geom, label))
 
     # put larger area geometry on the top of list
     geoms.sort(key=lambda x: x[0], reverse=True)
@@ -118,12 +159,16 @@ def check_topo(feats, tile, nx=256, ny=256):
     # Due to coco not support segmentation with holes.
     # So the exterior will be used as the segmentation
     for _, geom, label in geoms:
+        # clip in EPSG:3857 and only shift and scale the clipped part into
+        # tile-based coordinate-system
         geom = bbox.intersection(geom).buffer(0)
         if geom.area > 0:
-            yield (geom, label)
+            yield (affine_transform(geom, matrix), label)
 
 
-def burn_tile(geoms, task, pal, fname, nx=256, ny=256):
+def burn_tile(
+    geoms, task, pal, fname, nx=256, ny=256, backend="pil", catIdxs=None, mode="rgb"
+):
     """Burn a tile
 
     :param geoms: (geom, label) tuple
@@ -131,40 +176,161 @@ def burn_tile(geoms, task, pal, fname, nx=256, ny=256):
     :param fname: path to store the output image
     :param nx: image width
     :param ny: image length
+    :param backend: rasteriser, "pil" draws the polygon exteriors one by one,
+        "numpy" burns all polygons with their holes into class indices at once
+    :param catIdxs: label -> class index, required by the numpy backend and
+        the single channel modes
+    :param mode: "rgb" for palette colors, "palette" or "grayscale" for single
+        channel class indices
     """
     draws = []
-    im = Image.new(mode="RGB", size=(nx, ny), color="#000000")
-    draw = ImageDraw.Draw(im)
     for geom, label in geoms:
-        color = pal.color(label)
         if task == "segmentation":
-            if geom.type == "Polygon":
-                draws.append((list(geom.exterior.coords), color))
-            elif geom.type == "MultiPolygon":
-                draws += [(list(g.exterior.coords), color) for g in geom]
+            if geom.geom_type == "Polygon":
+                draws.append((geom, label, list(geom.exterior.coords)))
+            elif geom.geom_type == "MultiPolygon":
+                draws += [(g, label, list(g.exterior.coords)) for g in geom.geoms]
         elif task == "object detection":
-            bbox = bounds_to_bbox(geom.bounds)
-            draws.append((bbox, color))
+            draws.append((geom, label, bounds_to_bbox(geom.bounds)))
         else:
             raise TaskError
 
-    for idx, (coords, color) in enumerate(draws):
+    if backend == "numpy":
+        if task == "segmentation":
+            index = burn_polygons(
+                [(geom, catIdxs[label]) for geom, label, _ in draws], nx, ny
+            )
+        else:
+            index = burn_outlines(
+                [(geom.bounds, catIdxs[label]) for geom, label, _ in draws], nx, ny
+            )
+        # encode once, the class indices are mapped to the palette colors
+        save_label(index, fname, mode, color_lut(pal, catIdxs))
+        for idx, (_, label, coords) in enumerate(draws):
+            yield (idx, label, coords)
+        return
+
+    if mode == "rgb":
+        im = Image.new(mode="RGB", size=(nx, ny), color="#000000")
+    else:
+        im = Image.new(mode="L", size=(nx, ny), color=0)
+    draw = ImageDraw.Draw(im)
+    for idx, (_, label, coords) in enumerate(draws):
+        fill = pal.color(label) if mode == "rgb" else catIdxs[label]
         if task == "segmentation":
-            draw.polygon(coords, fill=color)
+            draw.polygon(coords, fill=fill)
         elif task == "object detection":
-            draw.line(coords)
+            draw.line(coords, fill=None if mode == "rgb" else fill)
 
         yield (idx, label, coords)
 
-    im.save(fname, "PNG")
+    if mode == "rgb":
+        im.save(fname, "PNG")
+    else:
+        save_label(np.asarray(im), fname, mode, color_lut(pal, catIdxs))
+
+
+class CocoWriter(object):
+    """Write a coco json file incrementally
+    Images are written to the file as they are added, annotations are
+    spooled to a temporary file next to it and appended when the images
+    array is closed, so memory does not grow with the number of tiles. With
+    indent the output is identical to json.dump(coco, f, indent=indent).
+
+    :param fpath: path of the coco json file
+    :param info: coco info
+    :param licenses: coco licenses
+    :param indent: json indent, None for compact output
+    """
+
+    def __init__(self, fpath, info, licenses, indent=2):
+        self.fpath = fpath
+        self.indent = indent
+        if indent is None:
+            self._nl, self._pad, self._colon = "", "", ":"
+        else:
+            self._nl, self._pad, self._colon = "\n", " " * indent, ": "
+        self.n_imgs = 0
+        self.n_annos = 0
+        self._f = open(fpath + ".part", "w", encoding="utf-8")
+        self._annos = tempfile.TemporaryFile(
+            "w+", encoding="utf-8", dir=os.path.dirname(os.path.abspath(fpath))
+        )
+        self._f.write("{")
+        self._member("info", info, first=True)
+        self._member("licenses", licenses)
+        self._key("images")
+        self._f.write("[")
+
+    def _dumps(self, obj, level):
+        if self.indent is None:
+            return json.dumps(obj, separators=(",", ":"))
+        text = json.dumps(obj, indent=self.indent)
+        return text.replace("\n", "\n" + self._pad * level)
+
+    def _key(self, key, first=False):
+        if not first:
+            self._f.write(",")
+        self._f.write(self._nl + self._pad + json.dumps(key) + self._colon)
+
+    def _member(self, key, value, first=False):
+        self._key(key, first)
+        self._f.write(self._dumps(value, 1))
+
+    def _element(self, f, obj, count):
+        if count:
+            f.write(",")
+        f.write(self._nl + self._pad * 2 + self._dumps(obj, 2))
+
+    def _close_array(self, count):
+        if count:
+            self._f.write(self._nl + self._pad)
+        self._f.write("]")
+
+    def add_image(self, img):
+        self._element(self._f, img, self.n_imgs)
+        self.n_imgs += 1
+
+    def add_annotation(self, anno):
+        self._element(self._annos, anno, self.n_annos)
+        self.n_annos += 1
+
+    def close(self, categories):
+        """close the arrays and write the categories
+
+        :param categories: coco categories
+        """
+        self._close_array(self.n_imgs)
+        self._key("annotations")
+        self._f.write("[")
+        self._annos.seek(0)
+        shutil.copyfileobj(self._annos, self._f)
+        self._annos.close()
+        self._close_array(self.n_annos)
+        self._member("categories", categories)
+        self._f.write(self._nl + "}")
+        self._f.close()
+        os.replace(self.fpath + ".part", self.fpath)
+
+    def abort(self):
+        """drop the partial file"""
+        self._annos.close()
+        self._f.close()
+        os.remove(self.fpath + ".part")
 
 
 class geococo(object):
     """class for generate geo coco
     https://www.immersivelimit.com/tutorials/create-coco-annotations-from-scratch
+
+    :param config: ohsome2label config
+    :param fpath: stream images and annotations into this coco json file
+        instead of keeping them in imgs and annos, the file is complete when
+        the context exits
+    :param indent: json indent of the streamed file, None for compact output
     """
 
-    def __init__(self, config):
+    def __init__(self, config, fpath=None, indent=2):
         self.tags_to_cats(config.tags)
 
         # coco info
@@ -185,11 +351,35 @@ class geococo(object):
         self.imgs = []
         self.annos = []
 
+        self.writer = None
+        if fpath is not None:
+            self.writer = CocoWriter(fpath, self.info, self.lic, indent)
+
     def __enter__(self):
         return self
 
     def __exit__(self, *exc):
-        return True
+        if self.writer is not None:
+            if exc[0] is None:
+                self.writer.close(self.cats)
+            else:
+                self.writer.abort()
+        # errors of the tiles reach the caller
+        return False
+
+    def add_image(self, img):
+        """add a coco image"""
+        if self.writer is None:
+            self.imgs.append(img)
+        else:
+            self.writer.add_image(img)
+
+    def add_annotation(self, anno):
+        """add a coco annotation"""
+        if self.writer is None:
+            self.annos.append(anno)
+        else:
+            self.writer.add_annotation(anno)
 
     def tags_to_cats(self, tags):
         """Convert tags to coco categories."""
@@ -222,112 +412,427 @@ class geococo(object):
         return coco
 
 
-def gen_label(cfg, workspace):
-    """Generate label and annotations in coco format
+# per-process state of the labelling workers, set by _init_worker
+_worker = {}
+
+
+def _init_worker(task, pal, catIdxs, tile_dir, img_dir, backend="pil", mode="rgb"):
+    """Initialize the state shared by every tile of a labelling process"""
+    _worker["task"] = task
+    _worker["backend"] = backend
+    _worker["mode"] = mode
+    _worker["pal"] = pal
+    _worker["catIdxs"] = catIdxs
+    _worker["tile_dir"] = tile_dir
+    _worker["img_dir"] = img_dir
+
+
+def _label_tile(job):
+    """Store geojson and burn label image of one tile
+
+    :param job: (tile, features, (geometry, label) tuples) tuple
+    :return: coco image and annotations of the tile, the image id is left
+             unset and annotation ids are local to the tile
+    """
+    tile, feats, geoms = job
+
+    # store geojson
+    fc = FeatureCollection(feats)
+    tile_name = "{0.z}.{0.x}.{0.y}".format(tile)
+    tile_path = os.path.join(_worker["tile_dir"], tile_name + ".geojson")
+    img_path = os.path.join(
+        _worker["img_dir"], tile_name + ".png"
+    )  # default image extension of .png
+    with open(tile_path, "w", encoding="utf-8") as gj:
+        try:
+            geojson.dump(fc, gj)
+        except Exception:
+            print("{}.geojson dump wrong!".format(tile_name))
+            assert 0
+
+    # burn tile
+    img = {}
+    img["id"] = None
+    img["width"] = nx
+    img["height"] = ny
+    img["file_name"] = tile_name + ".png"
+    annos = []
+    geoms = check_topo(geoms, tile, nx, ny)
+    burned_feats = burn_tile(
+        geoms,
+        _worker["task"],
+        _worker["pal"],
+        img_path,
+        nx,
+        ny,
+        backend=_worker["backend"],
+        catIdxs=_worker["catIdxs"],
+        mode=_worker["mode"],
+    )
+    for idx, label, coords in burned_feats:
+        catIdx = _worker["catIdxs"][label]
+        try:
+            annos.append(gen_anno(coords, idx, None, catIdx))
+        except Exception:
+            print(tile_name)
+
+    return img, annos
+
+
+def tiles_bbox(tiles):
+    """get the lnglat bounding box covering all tiles
+
+    :param tiles: list of tile tuple
+    :return: Bbox
+    """
+    xs = [t.x for t in tiles]
+    ys = [t.y for t in tiles]
+    z = tiles[0].z
+    west, north = west_north(Tile(min(xs), min(ys), z))
+    east, south = west_north(Tile(max(xs) + 1, max(ys) + 1, z))
+    return Bbox(west, south, east, north)
+
+
+def raw_files(cfg, workspace):
+    """get downloaded raw files of the config
 
     :param cfg: ohsome2label config
     :param workspace: workspace
+    :return: list of (path, tag) tuple, tag is None if the labels are matched
+             by the feature properties
     """
-    tile_dir = workspace.tile
-    img_dir = workspace.label
-    geoms = []
-    feats = {}
-    tile_feats = {}
-
-    # open downloaded geojson file
-    if cfg.api == "ohsome":
+    if cfg.api == "ohsome" and cfg.combine:
+        return [(os.path.join(workspace.raw, "ohsome_query.geojson"), None)]
+    elif cfg.api == "ohsome":
+        files = []
         for tag in cfg.tags:
             fname = "{lab}_{k}_{v}.geojson".format(
                 lab=tag["label"], k=tag["key"], v=tag["value"]
             )
-            fpath = os.path.join(workspace.raw, fname)
-            # get valid tile
-            with open(fpath, encoding="utf-8") as f:
-                data = geojson.loads(f.read().replace("'", ""))
-                features = data["features"]
-                for feature in features:
-                    geom = shape(feature["geometry"])
-                    geoms.append(geom)
-                    feature["properties"]["label"] = tag["label"]
-                    feats[geom.to_wkb()] = feature
+            files.append((os.path.join(workspace.raw, fname), tag))
+        return files
     elif cfg.api == "overpass":
-        fname = "overpass_query.geojson"
-        fpath = os.path.join(workspace.raw, fname)
-        with open(fpath, encoding="utf-8") as f:
-            data = geojson.loads(f.read().replace("'", ""))
-            features = data["features"]
-            for feature in features:
-                for tag in cfg.tags:
-                    key = tag.get("key", "")
-                    value = tag.get("value", "")
-                    if value == "" and key in feature["properties"]:
-                        geom = shape(feature["geometry"])
-                        geoms.append(geom)
-                        feature["properties"]["label"] = tag["label"]
-                        feats[geom.to_wkb()] = feature
-                        break
-                    elif feature["properties"].get(key, "") == value:
-                        geom = shape(feature["geometry"])
-                        geoms.append(geom)
-                        feature["properties"]["label"] = tag["label"]
-                        feats[geom.to_wkb()] = feature
-                        break
+        return [(os.path.join(workspace.raw, "overpass_query.geojson"), None)]
+    return []
 
-    tree = STRtree(geoms)
 
-    # clip by tile into small tile geojson
+def tag_label(tags, properties):
+    """get the label of the first tag matching the properties of a feature
+
+    :param tags: label tags, a tag with empty value matches any value of its key
+    :param properties: feature properties
+    :return: label, None if no tag matches
+    """
+    for tag in tags:
+        key = tag.get("key", "")
+        value = tag.get("value", "")
+        if value == "":
+            if key in properties:
+                return tag["label"]
+        elif properties.get(key) == value:
+            return tag["label"]
+    return None
+
+
+def load_features(cfg, workspace):
+    """Read downloaded features one by one and match them with tag labels
+
+    :param cfg: ohsome2label config
+    :param workspace: workspace
+    :return: generator of (shapely geometry, properties, label) tuple
+    """
+    # features of a feature store are filtered by its index, the others can
+    # not hit any tile anyway
+    bbox = tiles_bbox(cfg.tiles)
+
+    for fpath, tag in raw_files(cfg, workspace):
+        for geom, properties in read_features(fpath, bbox):
+            if tag is not None:
+                yield geom, properties, tag["label"]
+                continue
+            label = tag_label(cfg.tags, properties)
+            if label is not None:
+                yield geom, properties, label
+
+
+def build_index(cfg, workspace):
+    """Read features and assign them to tiles
+
+    :param cfg: ohsome2label config
+    :param workspace: workspace
+    :return: (feats, geoms, labels, tile_feats) tuple, feats, geoms and labels
+             are parallel lists, tile_feats maps a tile to feature positions
+    """
+    # geoms are projected to EPSG:3857 once, so tiles only need to shift and
+    # scale them
+    geoms = []
+    feats = []
+    labels = []
+
+    for geom, properties, label in load_features(cfg, workspace):
+        # only the shapely geometry is kept, it is much more compact than the
+        # parsed geojson coordinates and still dumps to geojson
+        properties["label"] = label
+        feats.append({"type": "Feature", "geometry": geom, "properties": properties})
+        geoms.append(to_mercator(geom))
+        labels.append(label)
+
+    tree = FeatureIndex(geoms)
+
+    # clip by tile into small tile geojson, a tile keeps the indices of its
+    # features only
+    tile_feats = {}
+    n_candidates = n_hits = 0
     for t in cfg.tiles:
-        _box = box(*get_bbox(t))
-        r = tree.query(_box)
+        _box = box(*get_xy_bbox(t))
+        candidates = tree.query(_box)
+        r = tree.intersects(_box, candidates)
+        n_candidates += len(candidates)
+        n_hits += len(r)
 
         if len(r) != 0:
-            tile = tile_feats.get(t, [])
-            for g in r:
-                tile.append(feats[g.to_wkb()])
-                tile_feats[t] = tile
+            tile_feats[t] = r
+    print(
+        "Tile features: {} bbox candidates, {} intersecting".format(
+            n_candidates, n_hits
+        )
+    )
+    return feats, geoms, labels, tile_feats
+
+
+def index_key(cfg, workspace):
+    """get the key of the tile index, it changes with the raw data, the tags
+    and the tiles
+
+    :param cfg: ohsome2label config
+    :param workspace: workspace
+    """
+    h = hashlib.sha256()
+    config = [cfg.api, cfg.tags, cfg.tiles]
+    h.update(json.dumps(config, sort_keys=True, default=str).encode("utf-8"))
+    for fpath, _ in raw_files(cfg, workspace):
+        for path in (fpath, store_path(fpath)):
+            if os.path.exists(path):
+                h.update(os.path.basename(path).encode("utf-8"))
+                h.update(file_hash(path).encode("utf-8"))
+    return h.hexdigest()
+
+
+def load_index(cfg, workspace, cache=True):
+    """Load the tile index from the workspace cache or build it
+
+    :param cfg: ohsome2label config
+    :param workspace: workspace
+    :param cache: read and write the cache in workspace.other
+    :return: same as build_index
+    """
+    path = os.path.join(workspace.other, INDEX_CACHE)
+    if cache:
+        key = index_key(cfg, workspace)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                if pickle.load(f) == key:
+                    print("Load tile index from cache:", path)
+                    return pickle.load(f)
+
+    index = build_index(cfg, workspace)
+
+    if cache:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    return index
+
+
+def feature_key(feat):
+    """get the digest of a feature, it changes with geometry and properties
+
+    :param feat: feature with shapely geometry
+    """
+    h = hashlib.sha1(feat["geometry"].wkb)
+    h.update(json.dumps(feat["properties"], sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def tile_key(tile_name, settings, feat_keys):
+    """get the input key of a tile
+
+    :param tile_name: name of the tile
+    :param settings: json serializable label settings
+    :param feat_keys: feature keys of the features in the tile
+    """
+    h = hashlib.sha1(tile_name.encode("utf-8"))
+    h.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    for key in feat_keys:
+        h.update(key.encode("utf-8"))
+    return h.hexdigest()
+
 
-    # free the variable for gc
-    del feats
+class TileManifest(object):
+    """Record of labelled tiles for resumable labelling.
+    Every line is the json of one tile with its input key, coco image and
+    annotations, so the file stays readable if a run is killed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tiles = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line of a killed run
+                        break
+                    self.tiles[record["tile"]] = record
+
+        # compact the records of former runs
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self.tiles.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp_path, path)
+        self._f = open(path, "a", encoding="utf-8")
+
+    def get(self, tile_name, key, tile_dir, img_dir):
+        """get image and annotations of an unchanged tile
+
+        :return: (image, annotations) tuple, None if the tile has to be labelled
+        """
+        record = self.tiles.get(tile_name)
+        if record is None or record["key"] != key:
+            return None
+        for path in (
+            os.path.join(tile_dir, tile_name + ".geojson"),
+            os.path.join(img_dir, tile_name + ".png"),
+        ):
+            if not os.path.exists(path):
+                return None
+        return record["img"], record["annos"]
+
+    def add(self, tile_name, key, img, annos):
+        """record a labelled tile"""
+        record = {"tile": tile_name, "key": key, "img": img, "annos": annos}
+        self._f.write(json.dumps(record) + "\n")
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+
+def gen_label(
+    cfg, workspace, workers=1, chunksize=16, cache=True, resume=False, compact=False
+):
+    """Generate label and annotations in coco format
+
+    :param cfg: ohsome2label config
+    :param workspace: workspace
+    :param workers: number of processes to burn tiles, 1 for serial
+    :param chunksize: number of tiles sent to a worker at once
+    :param cache: reuse the tile index of a former run with same data and tags
+    :param resume: skip tiles labelled by a former run with unchanged inputs
+    :param compact: write the coco json without indent
+    """
+    tile_dir = workspace.tile
+    img_dir = workspace.label
+    feats, geoms, labels, tile_feats = load_index(cfg, workspace, cache)
 
     pal = palette(cfg.tags, os.path.join(workspace.other, "colors"))
 
+    manifest_path = os.path.join(workspace.other, LABEL_MANIFEST)
+    if resume:
+        manifest = TileManifest(manifest_path)
+    else:
+        manifest = None
+        # tiles are rewritten, the records of a former run are not valid anymore
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+
     cocoPath = os.path.join(workspace.anno, "geococo.json")
-    with open(cocoPath, "w", encoding="utf-8") as f:
-        with geococo(cfg) as coco:
-            for imgIdx, tile in tqdm(enumerate(tile_feats)):
-                feats = tile_feats[tile]
-
-                # store geojson
-                fc = FeatureCollection(feats)
-                tile_name = "{0.z}.{0.x}.{0.y}".format(tile)
-                tile_path = os.path.join(tile_dir, tile_name + ".geojson")
-                img_path = os.path.join(
-                    img_dir, tile_name + ".png"
-                )  # default image extension of .png
-                with open(tile_path, "w", encoding="utf-8") as gj:
-                    try:
-                        geojson.dump(fc, gj)
-                    except Exception:
-                        print("{}.geojson dump wrong!".format(tile_name))
-                        assert 0
+    with geococo(cfg, cocoPath, indent=None if compact else 2) as coco:
+        _init_worker(
+            cfg.task, pal, coco.catIdxs, tile_dir, img_dir, cfg.backend, cfg.mode
+        )
+
+        # plan element is (tile name, input key, result of a former run)
+        plan = []
+        jobs = []
+        if manifest is not None:
+            settings = [
+                cfg.task,
+                cfg.backend,
+                cfg.mode,
+                nx,
+                ny,
+                coco.catIdxs,
+                {label: pal.color(label) for label in coco.catIdxs},
+            ]
+            feat_keys = [feature_key(feat) for feat in feats]
+        for t, r in tile_feats.items():
+            tile_name = "{0.z}.{0.x}.{0.y}".format(t)
+            key = result = None
+            if manifest is not None:
+                key = tile_key(tile_name, settings, [feat_keys[i] for i in r])
+                result = manifest.get(tile_name, key, tile_dir, img_dir)
+            plan.append((tile_name, key, result))
+            if result is None:
+                jobs.append(
+                    (t, [feats[i] for i in r], [(geoms[i], labels[i]) for i in r])
+                )
+        if manifest is not None:
+            print(
+                "Resume: {} tiles unchanged, {} tiles to label".format(
+                    len(plan) - len(jobs), len(jobs)
+                )
+            )
 
-                # burn tile
-                img = {}
+        if workers > 1 and jobs:
+            pool = Pool(
+                workers,
+                initializer=_init_worker,
+                initargs=(
+                    cfg.task,
+                    pal,
+                    coco.catIdxs,
+                    tile_dir,
+                    img_dir,
+                    cfg.backend,
+                    cfg.mode,
+                ),
+            )
+            results = pool.imap(_label_tile, jobs, chunksize=chunksize)
+        else:
+            pool = None
+            results = map(_label_tile, jobs)
+
+        # merge the tiles in order, so that image and annotation ids do not
+        # depend on the number of workers or former runs, they are streamed
+        # into the coco file as they are merged
+        try:
+            base_idx = 0
+            for imgIdx, (tile_name, key, result) in tqdm(
+                enumerate(plan), total=len(plan)
+            ):
+                if result is None:
+                    result = next(results)
+                    if manifest is not None:
+                        manifest.add(tile_name, key, *result)
+                img, annos = result
                 img["id"] = imgIdx
-                img["width"] = nx
-                img["height"] = ny
-                img["file_name"] = tile_name + ".png"
-                coco.imgs.append(img)
-                geoms = check_topo(feats, tile, nx, ny)
-                burned_feats = burn_tile(geoms, cfg.task, pal, img_path, nx, ny)
-                base_idx = len(coco.annos)
-                for idx, label, coords in burned_feats:
-                    catIdx = coco.catIdxs[label]
-                    try:
-                        coco.annos.append(
-                            gen_anno(coords, base_idx + idx, imgIdx, catIdx)
-                        )
-                    except Exception:
-                        print(imgIdx)
-
-            json.dump(coco.to_json(), f, indent=2)
+                coco.add_image(img)
+                for anno in annos:
+                    anno["id"] += base_idx
+                    anno["image_id"] = imgIdx
+                    coco.add_annotation(anno)
+                base_idx += len(annos)
+        finally:
+            # all results are merged or a tile failed, the workers are idle
+            # or not needed anymore either way
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if manifest is not None:
+                manifest.close()
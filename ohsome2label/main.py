@@ -4,11 +4,14 @@ import click
 from tqdm import tqdm
 
 from ohsome2label.config import Config, Parser, workspace
+from ohsome2label.export import export_shards, pack_tiles
 from ohsome2label.label import gen_label
 from ohsome2label.overpass import download_overpass
 from ohsome2label.utils import download_osm, download_img
 from ohsome2label.visualize import visualize_combined, visualize_overlay
 from ohsome2label.quality import get_osm_quality
+from ohsome2label.store import convert_raw
+from ohsome2label.tilecache import TileCache
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
 
@@ -40,8 +43,18 @@ def cli(ctx, verbose, config, schema):
 
 
 @cli.command(help="Download vector OSM data from ohsomeAPI")
+@click.option("--store", is_flag=True, default=False,
+              help="Also convert the downloaded data into binary feature stores.")
+@click.option("--chunk-size", type=click.IntRange(min=0), default=0,
+              help="Request the OSM data in chunks of N x N tiles, 0 for no chunks.")
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=1,
+              help="Number of concurrent chunk requests.")
+@click.option("--endpoint", "endpoints", multiple=True,
+              help="Overpass interpreter url, repeat to spread queries over endpoints.")
+@click.option("--retries", type=click.IntRange(min=0), default=3,
+              help="Number of retries of a failed overpass query.")
 @click.pass_obj
-def vector(config):
+def vector(config, store, chunk_size, workers, endpoints, retries):
     print(
         "Download OSM historical data into dir:\n{}".format(
             os.path.abspath(config.workspace.raw)
@@ -51,28 +64,95 @@ def vector(config):
     workspace = config.workspace
     api = cfg.api
     if api == "ohsome":
-        download_osm(cfg, workspace)
+        download_osm(cfg, workspace, chunk_size=chunk_size, workers=workers)
     elif api == "overpass":
-        download_overpass(cfg, workspace)
+        download_overpass(
+            cfg,
+            workspace,
+            endpoints=endpoints,
+            chunk_size=chunk_size,
+            workers=workers,
+            retries=retries,
+        )
+    if store:
+        print("Convert OSM data into binary feature stores.")
+        convert_raw(workspace)
 
 
 @cli.command(help="Generate tile")
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=1,
+              help="Number of processes to burn tiles in parallel.")
+@click.option("--cache/--no-cache", default=True,
+              help="Reuse the tile index of a former run with same data and tags.")
+@click.option("--resume", is_flag=True, default=False,
+              help="Skip tiles labelled by a former run with unchanged inputs.")
+@click.option("--compact", is_flag=True, default=False,
+              help="Write the coco annotations without indent.")
 @click.pass_obj
-def label(config):
+def label(config, workers, cache, resume, compact):
     cfg = config.o2l_cfg
     workspace = config.workspace
     print("Tile the OSM data into given zoom level:", cfg.zoom)
-    gen_label(cfg, workspace)
+    gen_label(
+        cfg, workspace, workers=workers, cache=cache, resume=resume, compact=compact
+    )
 
 
 @cli.command(help="Download satellite image")
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=1,
+              help="Number of concurrent downloads.")
+@click.option("--rate", "-r", type=click.FloatRange(min=0), default=0,
+              help="Maximum requests per second to each host, 0 for no limit.")
+@click.option("--retries", type=click.IntRange(min=0), default=0,
+              help="Retries of a failed connection.")
+@click.option("--resume", is_flag=True, default=False,
+              help="Only download images which are missing or broken.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None,
+              help="Tile cache shared across projects, disabled by default.")
+@click.option("--cache-size", type=click.FloatRange(min=0), default=0,
+              help="Maximum size of the tile cache in MB, 0 for no limit.")
 @click.pass_obj
-def image(config):
+def image(config, workers, rate, retries, resume, cache_dir, cache_size):
     cfg = config.o2l_cfg
     if config.verbose:
         pass  # add output later
     print("Start download satellite image!")
-    download_img(cfg, config.workspace)
+    cache = None
+    if cache_dir is not None:
+        cache = TileCache(cache_dir, int(cache_size * 2 ** 20))
+    download_img(
+        cfg, config.workspace, workers=workers, rate=rate, retries=retries,
+        resume=resume, cache=cache,
+    )
+    if cache is not None:
+        cache.close()
+
+
+@cli.command(help="Export labelled tiles for training")
+@click.option("--format", "fmt", type=click.Choice(["npy", "tfrecord", "tar"]),
+              default="npy",
+              help="Packed memory mappable .npy arrays, TFRecord or tar (WebDataset) shards.")
+@click.option("--output", "-o", type=click.Path(file_okay=False), default=None,
+              help="Output directory, defaults to the export directory of the workspace.")
+@click.option("--images/--no-images", default=True,
+              help="Also pack the downloaded imagery.")
+@click.option("--workers", "-w", type=click.IntRange(min=1), default=1,
+              help="Number of threads decoding the pngs, or processes writing shards.")
+@click.option("--shards", type=click.IntRange(min=1), default=4,
+              help="Number of TFRecord or tar shards.")
+@click.option("--val-fraction", type=click.FloatRange(0, 1), default=0.2,
+              help="Fraction of the tiles in the val shards.")
+@click.pass_obj
+def export(config, fmt, output, images, workers, shards, val_fraction):
+    cfg = config.o2l_cfg
+    workspace = config.workspace
+    print("Export labelled tiles as {} into dir:\n{}".format(
+        fmt, os.path.abspath(output or workspace.export)))
+    if fmt == "npy":
+        pack_tiles(cfg, workspace, out_dir=output, images=images, workers=workers)
+    else:
+        export_shards(workspace, fmt=fmt, out_dir=output, shards=shards,
+                      val_fraction=val_fraction, workers=workers)
 
 
 @cli.command(help="Visualize of training samples")
@@ -12,12 +12,23 @@ Author: Zhaoyan Wu
 import json
 import os
 import logging
+import re
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import geojson
 import requests
+import tqdm
 from shapely.geometry import Polygon
 from shapely.geometry.polygon import orient
+from shapely.prepared import prep
+
+from ohsome2label.reader import CHUNK_SIZE, iter_array, read_chunks
+from ohsome2label.spatial import FeatureIndex
+from ohsome2label.tile import chunk_bboxes
+from ohsome2label.utils import HostSessions, write_features
 
 log = logging.getLogger("__name__")
 
@@ -29,28 +40,55 @@ with open(_polygon_features_file, "r", encoding="utf-8") as f:
     _polygon_features = json.load(f)
 
 
+def compile_polygon_rules(features):
+    """compile polygon features into key -> (mode, values) lookup table
+
+    :param features: content of polygon-features.json
+    """
+    rules = {}
+    for feat in features:
+        rules[feat["key"]] = (feat["polygon"], frozenset(feat.get("values", ())))
+    return rules
+
+
+_polygon_rules = compile_polygon_rules(_polygon_features)
+
+
 def is_polygon_feature(key, value):
-    keys = {feat["key"]: i for i, feat in enumerate(_polygon_features)}
-    if key not in keys:
+    rule = _polygon_rules.get(key)
+    if rule is None:
         return False
 
-    feat = _polygon_features[keys[key]]
-    if feat["polygon"] == "all":
+    mode, values = rule
+    if mode == "all":
         return True
-    elif feat["polygon"] == "whitelist":
-        if value in feat["values"]:
-            return True
-        else:
-            return False
-    elif feat["polygon"] == "blacklist":
-        if value in feat["values"]:
-            return False
-        else:
-            return True
+    elif mode == "whitelist":
+        return value in values
+    elif mode == "blacklist":
+        return value not in values
 
     return False
 
 
+def classify_polygon_features(pairs):
+    """classify many (key, value) pairs at once
+
+    :param pairs: iterable of (key, value) tuple
+    :return: list of bool, True for polygon feature
+    """
+    return [is_polygon_feature(key, value) for key, value in pairs]
+
+
+def is_area(tags):
+    """check if a closed way with tags is an area, area=no always wins
+
+    :param tags: tags of the way
+    """
+    if tags.get("area") == "no":
+        return False
+    return any(classify_polygon_features(tags.items()))
+
+
 def get_properties(elem, timestamp):
     """generate properties of output geojson feature"""
     properties = {}
@@ -61,39 +99,98 @@ def get_properties(elem, timestamp):
 
 
 def way_to_geometry(way):
-    """generate geometry from OSM way"""
+    """generate geometry from OSM way, closed ways are only polygons if their
+    tags are polygon features"""
     coords = [(coord["lon"], coord["lat"]) for coord in way["geometry"]]
-    if coords[0] == coords[-1]:
-        return geojson.Polygon([coords])
-    else:
+    if coords[0] != coords[-1]:
         log.error("way/{} is not a polygon".format(way["id"]))
         return None
+    elif not is_area(way.get("tags", {})):
+        log.debug("way/{} is a closed line".format(way["id"]))
+        return None
+    else:
+        return geojson.Polygon([coords])
 
 
 def make_ring(parts):
-    for j, other in enumerate(parts):
-        if other == []:
+    """Join way fragments at shared end points into rings.
+    Fragments are looked up by their end points, so every fragment is visited
+    once and a ring grows until it is closed or no fragment continues it.
+
+    :param parts: list of coordinate lists
+    :return: list of joined coordinate lists, rings which can not be closed
+             are returned open
+    """
+    # end point -> positions of fragments starting or ending there
+    ends = defaultdict(list)
+    for i, part in enumerate(parts):
+        if part and part[0] != part[-1]:
+            ends[part[0]].append(i)
+            ends[part[-1]].append(i)
+
+    used = [not part for part in parts]
+
+    def _next(point):
+        """pop an unused fragment with an end at point, oriented to start there"""
+        candidates = ends[point]
+        while candidates:
+            i = candidates.pop()
+            if used[i]:
+                continue
+            used[i] = True
+            part = parts[i]
+            if part[0] == point:
+                return part
+            return part[::-1]
+        return None
+
+    rings = []
+    for i, part in enumerate(parts):
+        if used[i]:
             continue
-        for i, part in enumerate(parts):
-            if part == [] or part == other:
+        used[i] = True
+        ring = list(part)
+        reversed_once = False
+        while ring[0] != ring[-1] or len(ring) == 1:
+            other = _next(ring[-1])
+            if other is None:
+                if reversed_once:
+                    break
+                # continue at the other end
+                ring.reverse()
+                reversed_once = True
                 continue
-            if part[-1] == other[0]:
-                part.extend(other[1:])
-                other.clear()
-                break
-            elif part[-1] == other[-1]:
-                part.extend(other[-2::-1])
-                other.clear()
-                break
-            elif part[0] == other[0]:
-                part[0:0] = other[-1:0:-1]
-                other.clear()
-                break
-            elif part[0] == other[-1]:
-                part[0:0] = other[:-1]
-                other.clear()
-                break
-    return [part for part in parts if part != []]
+            ring.extend(other[1:])
+        rings.append(ring)
+    return rings
+
+
+def assign_inners(outers, inners):
+    """Assign every inner ring to the smallest outer ring containing it
+    Candidates are looked up in a spatial index over the inners and tested
+    with prepared outers.
+
+    :param outers: list of outer polygons
+    :param inners: list of inner polygons
+    :return: list of sorted inner positions for every outer
+    """
+    owner = [None] * len(inners)
+    if inners:
+        tree = FeatureIndex(inners)
+        areas = [outer.area for outer in outers]
+        for j, outer in enumerate(outers):
+            prepared = prep(outer)
+            for i in tree.query(outer):
+                if owner[i] is not None and areas[owner[i]] <= areas[j]:
+                    continue
+                if prepared.contains(inners[i]):
+                    owner[i] = j
+
+    holes = [[] for _ in outers]
+    for i, j in enumerate(owner):
+        if j is not None:
+            holes[j].append(i)
+    return holes
 
 
 def rel_to_geometry(rel):
@@ -151,12 +248,15 @@ def rel_to_geometry(rel):
         log.error("outer is None, wrong")
         return None
 
+    # every inner is a hole of the smallest outer containing it, so an inner
+    # of an island lying in a hole of another outer belongs to the island
+    holes = assign_inners(outers, inners)
+
     polys = []
-    for outer in outers:
+    for outer, outer_holes in zip(outers, holes):
         poly = [list(outer.exterior.coords)]
-        for inner in inners:
-            if outer.contains(inner):
-                poly.append(list(orient(inner, sign=-1).exterior.coords))
+        for i in outer_holes:
+            poly.append(list(orient(inners[i], sign=-1).exterior.coords))
 
         polys.append(poly)
 
@@ -165,31 +265,33 @@ def rel_to_geometry(rel):
     return geometry
 
 
-def osm_to_geojson(osm, date):
-    """ Convert osm json to geojson.
-        The input osm is produced by overpass_ql with "out geom;"
+def iter_osm_features(elems, date):
+    """ Convert osm elements to geojson features one by one.
+        The input elements are produced by overpass_ql with "out geom;"
+
+    :param elems: iterable of osm elements, e.g. streamed by reader.iter_array
+    :param date: snapshot timestamp of the features
     """
-    way_features = []
-    rel_features = []
     timestamp = date
-    elems = osm["elements"]
 
     for elem in elems:
         properties = get_properties(elem, timestamp)
         if elem["type"] == "way":
             geometry = way_to_geometry(elem)
-            if geometry is None:
-                continue
-            feature = geojson.Feature(geometry=geometry, properties=properties)
-            way_features.append(feature)
         elif elem["type"] == "relation":
             geometry = rel_to_geometry(elem)
-            if geometry is None:
-                continue
-            feature = geojson.Feature(geometry=geometry, properties=properties)
-            way_features.append(feature)
+        else:
+            continue
+        if geometry is None:
+            continue
+        yield geojson.Feature(geometry=geometry, properties=properties)
 
-    features = rel_features + way_features
+
+def osm_to_geojson(osm, date):
+    """ Convert osm json to geojson.
+        The input osm is produced by overpass_ql with "out geom;"
+    """
+    features = list(iter_osm_features(osm["elements"], date))
 
     return geojson.FeatureCollection(features)
 
@@ -284,31 +386,183 @@ class overpass(object):
             if arg in self._statements:
                 self._statements.remove(arg)
 
-    def query(self):
+    @property
+    def ql(self):
+        """get the overpass ql of settings, statements and out format"""
         settings = "".join(self._settings) + ";"
         statements = "(" + ";".join(self._statements) + ";);"
         statements += "out {};".format(self._out)
-        overpass_ql = {"data": "".join([settings, statements])}
+        return "".join([settings, statements])
+
+    def query(self, stream=False):
+        """post the query
+
+        :param stream: do not load the response body at once
+        """
         try:
-            r = requests.post(self.endpoint, data=overpass_ql)
+            r = requests.post(self.endpoint, data={"data": self.ql}, stream=stream)
         except requests.exceptions.Timeout:
-            log.error(r.url)
-            raise Exception
+            log.error("Overpass query timed out: %s" % self.endpoint)
+            raise
 
         return r
 
 
-def download_overpass(cfg, workspace, url=""):
-    op = overpass(endpoint=url)
-    op.add_settings("[out:json]")
-    op.add_settings("[timeout:3600]")
-    op.add_settings("[maxsize:1073741824]")
-    op.add_settings("[bbox:{}]".format(cfg.op_bbox))
-    date = "{}T00:00:00Z".format(cfg.timestamp)
-    op.add_settings("[date:'{}']".format(date))
-    tgt_dir = workspace.raw
-    fpath = os.path.join(tgt_dir, "overpass_query.geojson")
+def parse_status(text):
+    """Parse the /status page of an overpass endpoint
+
+    :param text: content of the status page
+    :return: (rate limit, available slots, seconds until the next slot), the
+        rate limit is 0 if the endpoint does not limit queries
+    """
+    match = re.search(r"Rate limit: (\d+)", text)
+    limit = int(match.group(1)) if match else 0
+    match = re.search(r"(\d+) slots? available now", text)
+    available = int(match.group(1)) if match else 0
+    waits = [int(s) for s in re.findall(r"in (-?\d+) seconds", text)]
+    wait = max(min(waits), 0) if waits else 0
+    if not limit:
+        available = max(available, 1)
+    return limit, available, wait
+
+
+def status_url(endpoint):
+    """get the status url of an interpreter endpoint"""
+    return endpoint.rsplit("/", 1)[0] + "/status"
+
+
+def query_timeout(ql, default=180):
+    """get the seconds of the [timeout:] setting of an overpass ql, overpass
+    defaults to 180 seconds"""
+    match = re.search(r"\[timeout:(\d+)\]", ql)
+    return int(match.group(1)) if match else default
+
+
+def response_remark(fpath, tail=1 << 16):
+    """Get the remark of an overpass json response
+    Overpass reports a query that timed out or ran out of memory with status
+    200 and a "remark" member after the elements, so only the end of the
+    response is read.
+
+    :param fpath: path of the response
+    :param tail: number of bytes read from the end
+    :return: remark, None if there is none
+    """
+    with open(fpath, "rb") as f:
+        f.seek(max(os.path.getsize(fpath) - tail, 0))
+        text = f.read().decode("utf-8", errors="replace")
+    # the remark follows the elements array, tags named remark do not
+    match = re.search(r'\]\s*,\s*"remark"\s*:\s*"((?:[^"\\]|\\.)*)"', text)
+    return json.loads('"{}"'.format(match.group(1))) if match else None
+
+
+class OverpassError(Exception):
+    """query failed on every endpoint"""
+
+
+class OverpassClient(object):
+    """Run overpass queries concurrently on a list of endpoints
+    Queries are distributed round robin over the endpoints. Before a query
+    the /status page of the endpoint is asked for a free slot, failed
+    queries (e.g. 429 too many requests or 504 gateway timeout) are retried
+    on the next endpoint with exponential backoff. A query also fails when
+    the endpoint stalls beyond the [timeout:] of the query, or when the
+    response has a runtime error remark.
+
+    :param endpoints: list of interpreter urls
+    :param retries: number of retries of a failed query
+    :param backoff: seconds to wait before the first retry, doubled per retry
+    :param max_wait: maximum seconds to wait for a slot or a retry
+    :param slots: maximum concurrent queries per endpoint
+    :param grace: seconds to wait for a response beyond the [timeout:] of the
+        query, before the endpoint is considered stalled
+    """
 
+    def __init__(
+        self, endpoints, retries=3, backoff=2.0, max_wait=300, slots=2, grace=30
+    ):
+        self.endpoints = list(endpoints)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.grace = grace
+        self._sessions = HostSessions(pool_size=slots)
+        self._slots = {e: threading.BoundedSemaphore(slots) for e in self.endpoints}
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def _endpoint(self):
+        with self._lock:
+            endpoint = self.endpoints[self._next % len(self.endpoints)]
+            self._next += 1
+        return endpoint
+
+    def status(self, endpoint):
+        """get the parsed status of an endpoint, None if it has no status"""
+        url = status_url(endpoint)
+        try:
+            r = self._sessions.get(url).get(url, timeout=30)
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            return None
+        return parse_status(r.text)
+
+    def wait_slot(self, endpoint):
+        """block until the endpoint reports a free slot"""
+        waited = 0
+        while waited < self.max_wait:
+            status = self.status(endpoint)
+            if status is None or status[1] > 0:
+                return
+            delay = min(max(status[2], 1), self.max_wait - waited)
+            log.info("No overpass slot on %s, wait %ds" % (endpoint, delay))
+            time.sleep(delay)
+            waited += delay
+
+    def fetch(self, ql, fpath):
+        """Post a query and stream the response to fpath
+
+        :param ql: overpass ql
+        :param fpath: path of the response
+        :return: number of written bytes
+        """
+        # the server answers once the query ran, at most [timeout:] seconds
+        timeout = (self.grace, query_timeout(ql) + self.grace)
+        tmp_path = fpath + ".part"
+        for attempt in range(self.retries + 1):
+            endpoint = self._endpoint()
+            with self._slots[endpoint]:
+                self.wait_slot(endpoint)
+                try:
+                    r = self._sessions.get(endpoint).post(
+                        endpoint, data={"data": ql}, stream=True, timeout=timeout
+                    )
+                    r.raise_for_status()
+                    size = 0
+                    with open(tmp_path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+                    remark = response_remark(tmp_path)
+                    if remark is not None and "runtime error" in remark:
+                        # the elements are incomplete
+                        raise OverpassError(remark)
+                    os.replace(tmp_path, fpath)
+                    return size
+                except (requests.exceptions.RequestException, OverpassError) as e:
+                    log.warning("Overpass query failed on %s. %s" % (endpoint, e))
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            if attempt < self.retries:
+                time.sleep(min(self.backoff * 2 ** attempt, self.max_wait))
+        raise OverpassError("query failed after {} retries".format(self.retries))
+
+    def close(self):
+        self._sessions.close()
+
+
+def overpass_tags(cfg):
+    """get key -> values of the config tags, "." matches any value"""
     kvs = defaultdict(set)
     for tag in cfg.tags:
         value = tag.get("value", "")
@@ -316,12 +570,125 @@ def download_overpass(cfg, workspace, url=""):
             kvs[tag["key"]].add(value)
         else:
             kvs[tag["key"]] = set(".")
+    return kvs
 
-    for key in kvs:
-        query = '~"^{}$"~"({})"'.format(key, "|".join(kvs[key]))
-        op.add_statements("way[{}]".format(query))
-        op.add_statements("rel[{}]".format(query))
-    mf = osm_to_geojson(op.query().json(), date)
-    if mf is not None:
-        with open(fpath, "w", encoding="utf-8") as f:
-            json.dump(mf, f, indent=2)
+
+def overpass_queries(cfg, chunk_size=0):
+    """Build the overpass ql of the config
+    Without chunk_size all tags are queried at once in the bbox. Otherwise
+    the bbox is split into tile aligned chunks and every (chunk, key) is one
+    query. The bbox filter is put on the statements instead of the global
+    bbox setting, so geometries are not clipped and features crossing chunk
+    edges are identical in every chunk.
+
+    :param cfg: config from config.yaml
+    :param chunk_size: width and height of a chunk in tiles, 0 for no split
+    :return: list of overpass ql
+    """
+    date = "{}T00:00:00Z".format(cfg.timestamp)
+    kvs = overpass_tags(cfg)
+    if chunk_size > 0:
+        boxes = [
+            "({},{},{},{})".format(box.south, box.west, box.north, box.east)
+            for box in chunk_bboxes(cfg.bboxes, cfg.zoom, chunk_size)
+        ]
+        groups = [[key] for key in kvs]
+    else:
+        boxes = [""]
+        groups = [list(kvs)]
+
+    queries = []
+    for box in boxes:
+        for keys in groups:
+            op = overpass()
+            op.add_settings("[out:json]")
+            op.add_settings("[timeout:3600]")
+            op.add_settings("[maxsize:1073741824]")
+            if not box:
+                op.add_settings("[bbox:{}]".format(cfg.op_bbox))
+            op.add_settings("[date:'{}']".format(date))
+            for key in keys:
+                query = '~"^{}$"~"({})"'.format(key, "|".join(sorted(kvs[key])))
+                op.add_statements("way[{}]{}".format(query, box))
+                op.add_statements("rel[{}]{}".format(query, box))
+            queries.append(op.ql)
+    return queries
+
+
+def iter_elements(paths):
+    """Yield osm elements of overpass json files, elements of the same type and
+    id are only yielded once"""
+    seen = set()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for elem in iter_array(read_chunks(f), "elements"):
+                key = (elem.get("type"), elem.get("id"))
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield elem
+
+
+def download_overpass(
+    cfg, workspace, url="", endpoints=None, chunk_size=0, workers=1, retries=3
+):
+    """Download osm polygons with overpass and convert them to geojson
+
+    :param cfg: config from config.yaml
+    :param workspace: workspace to store osm data
+    :param url: interpreter url, the config url is used if it is empty
+    :param endpoints: list of interpreter urls to distribute the queries on
+    :param chunk_size: split the bbox into chunks of chunk_size tiles and the
+        query by key, 0 for a single query
+    :param workers: number of concurrent queries
+    :param retries: number of retries of a failed query
+    :raises OverpassError: if a query failed on every endpoint
+    """
+    endpoints = list(endpoints or []) or [url or cfg.url]
+    date = "{}T00:00:00Z".format(cfg.timestamp)
+    fpath = os.path.join(workspace.raw, "overpass_query.geojson")
+    chunk_dir = os.path.join(workspace.raw, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    queries = overpass_queries(cfg, chunk_size)
+    paths = [
+        os.path.join(chunk_dir, "overpass.{}.json".format(i))
+        for i in range(len(queries))
+    ]
+    client = OverpassClient(endpoints, retries=retries)
+
+    def _fetch(job):
+        ql, path = job
+        try:
+            return client.fetch(ql, path)
+        except OverpassError as e:
+            log.warning("%s: %s" % (path, e))
+
+    print(
+        "Download {} overpass queries from {} endpoints".format(
+            len(queries), len(endpoints)
+        )
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(
+            tqdm.tqdm(executor.map(_fetch, zip(queries, paths)), total=len(queries))
+        )
+    client.close()
+
+    failed = [path for path, size in zip(paths, sizes) if size is None]
+    if failed:
+        # keep the responses, an incomplete merge would look like a complete file
+        log.warning("%d queries failed, the results are not merged" % len(failed))
+        raise OverpassError(
+            "{} of {} overpass queries failed".format(
+                len(failed), len(queries)
+            )
+        )
+
+    # parse the responses element by element and write the features as they
+    # are converted, memory does not grow with the response size
+    write_features(fpath, iter_osm_features(iter_elements(paths), date))
+    for path in paths:
+        os.remove(path)
+    if not os.listdir(chunk_dir):
+        os.rmdir(chunk_dir)
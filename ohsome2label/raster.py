@@ -0,0 +1,208 @@
+"""
+Vectorised rasteriser for label tiles.
+All polygons of a tile are burned into one single-channel uint8 array of
+class indices. Every ring of a polygon contributes its edges to a scanline
+fill with the even-odd rule, so interior rings become holes. The crossings
+of all edges with all pixel rows are computed at once, the spans between
+them are painted in drawing order, later polygons cover earlier ones like
+they do with PIL.
+"""
+import numpy as np
+import shapely
+from PIL import Image
+
+from ohsome2label.spatial import SHAPELY_2
+
+if not SHAPELY_2:
+    from shapely.geos import WKBWriter, lgeos
+
+
+def hex_to_rgb(color):
+    """convert a "#rrggbb" color to a (r, g, b) tuple"""
+    color = color.lstrip("#")
+    return tuple(int(color[i : i + 2], 16) for i in (0, 2, 4))
+
+
+def color_lut(pal, catIdxs):
+    """Get the rgb color of every class index
+
+    :param pal: palette
+    :param catIdxs: label -> class index, 0 is the background
+    :return: (n, 3) uint8 array up to the largest class index, black for
+        unused indices
+    """
+    lut = np.zeros((max(catIdxs.values(), default=0) + 1, 3), dtype=np.uint8)
+    for label, idx in catIdxs.items():
+        lut[idx] = hex_to_rgb(pal.color(label))
+    return lut
+
+
+def save_label(index, fname, mode="rgb", lut=None):
+    """Encode an array of class indices as png
+
+    :param index: (ny, nx) uint8 array of class indices
+    :param fname: path of the png
+    :param mode: "rgb" for the palette colors, "palette" for an indexed png
+        with the palette colors embedded, "grayscale" for 8 bit class indices
+    :param lut: color of every class index, see color_lut
+    """
+    im = Image.fromarray(index)
+    if mode != "grayscale":
+        # a short palette lets the png use a lower bit depth
+        im.putpalette(lut.tobytes())
+    if mode == "rgb":
+        # PIL maps the indices to colors much faster than a numpy lookup
+        im = im.convert("RGB")
+    im.save(fname, "PNG")
+
+
+def _wkb_coords(polygons):
+    """Get the coordinates of all rings of polygons from their WKB
+    The rings are walked level by level for all polygons at once, so the
+    number of steps is the largest number of rings of a polygon.
+
+    :param polygons: list of shapely polygons
+    :return: (n, 2) array of coordinates and (n,) arrays of the ring number
+        and the polygon index of every coordinate
+    """
+    # polygon.wkb creates a new writer for every polygon
+    writer = WKBWriter(lgeos)
+    blobs = [writer.write(polygon) for polygon in polygons]
+    buf = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+    lengths = np.fromiter(map(len, blobs), dtype=np.int64, count=len(blobs))
+    starts = np.cumsum(lengths) - lengths
+    order = "<" if buf[0] == 1 else ">"
+
+    def read(offsets, size, kind):
+        raw = buf[offsets[:, None] + np.arange(size)]
+        return raw.view(order + kind + str(size)).ravel()
+
+    # GEOS flags coordinates with z in the type of extended WKB
+    dims = np.where(read(starts + 1, 4, "u") & 0x80000000, 3, 2)
+    n_rings = read(starts + 5, 4, "u").astype(np.int64)
+    cursor = starts + 9
+    ring_starts, ring_points, ring_dims, ring_ids = [], [], [], []
+    polys = np.arange(len(polygons))
+    for level in range(int(n_rings.max(initial=0))):
+        polys = polys[n_rings[polys] > level]
+        points = read(cursor[polys], 4, "u").astype(np.int64)
+        ring_starts.append(cursor[polys] + 4)
+        ring_points.append(points)
+        ring_dims.append(dims[polys])
+        ring_ids.append(polys)
+        cursor[polys] += 4 + points * 8 * dims[polys]
+
+    ring_starts = np.concatenate(ring_starts)
+    ring_points = np.concatenate(ring_points)
+    ring_dims = np.concatenate(ring_dims)
+    ring_ids = np.concatenate(ring_ids)
+    # byte offset of x of every point, y follows after 8 bytes
+    ring = np.repeat(np.arange(len(ring_points)), ring_points)
+    first = np.cumsum(ring_points) - ring_points
+    point = np.arange(len(ring)) - np.repeat(first, ring_points)
+    offsets = ring_starts[ring] + point * 8 * ring_dims[ring]
+    coords = read(np.concatenate((offsets, offsets + 8)), 8, "f")
+    return coords.reshape(2, -1).T, ring, ring_ids[ring]
+
+
+def polygon_edges(polygons):
+    """Get the edges of all rings of polygons
+
+    :param polygons: list of shapely polygons
+    :return: (n, 4) array of x0, y0, x1, y1 edges and (n,) array of the
+        polygon index of every edge
+    """
+    if SHAPELY_2:
+        rings, ring_ids = shapely.get_rings(polygons, return_index=True)
+        coords, coord_rings = shapely.get_coordinates(rings, return_index=True)
+        coord_ids = ring_ids[coord_rings]
+    else:
+        coords, coord_rings, coord_ids = _wkb_coords(polygons)
+    # an edge joins consecutive coordinates of the same ring
+    same = coord_rings[1:] == coord_rings[:-1]
+    edges = np.hstack((coords[:-1][same], coords[1:][same]))
+    return edges, coord_ids[:-1][same]
+
+
+def scanline_spans(edges, ids, nx, ny):
+    """Get the filled spans of the rows crossed by the edges
+    A pixel is filled if its center is inside, the rows are crossed half
+    open, so every closed ring crosses a row an even number of times.
+
+    :param edges: (n, 4) array of x0, y0, x1, y1 edges
+    :param ids: (n,) array of polygon index of the edges
+    :param nx: image width
+    :param ny: image length
+    :return: (rows, start columns, end columns, polygon indexes) of the spans
+    """
+    x0, y0, x1, y1 = edges.T
+    keep = y0 != y1
+    x0, y0, x1, y1, ids = x0[keep], y0[keep], x1[keep], y1[keep], ids[keep]
+    r0 = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, ny).astype(np.int64)
+    r1 = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, ny).astype(np.int64)
+    counts = r1 - r0
+    total = counts.sum()
+    edge = np.repeat(np.arange(len(counts)), counts)
+    rows = r0[edge] + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    xs = x0[edge] + (rows + 0.5 - y0[edge]) * (x1[edge] - x0[edge]) / (
+        y1[edge] - y0[edge]
+    )
+    ids = ids[edge]
+
+    # pair the crossings of each polygon and row from left to right, the
+    # crossings are sorted by x once and then by polygon and row with the
+    # rank of x as the last digit of one integer key
+    order = np.argsort(xs)
+    key = (ids[order] * (ny + 1) + rows[order]) * len(xs) + np.arange(len(xs))
+    order = order[np.argsort(key)]
+    rows, xs, ids = rows[order], xs[order], ids[order]
+    start = np.clip(np.ceil(xs[0::2] - 0.5), 0, nx).astype(np.int64)
+    end = np.clip(np.ceil(xs[1::2] - 0.5), 0, nx).astype(np.int64)
+    return rows[0::2], start, end, ids[0::2]
+
+
+def burn_polygons(polygons, nx=256, ny=256):
+    """Burn polygons into an array of class indices
+
+    :param polygons: list of (shapely polygon, class index) tuple in drawing
+        order, coordinates are in pixels
+    :param nx: image width
+    :param ny: image length
+    :return: (ny, nx) uint8 array, 0 where no polygon is burned
+    """
+    out = np.zeros((ny, nx), dtype=np.uint8)
+    if not polygons:
+        return out
+    edges, ids = polygon_edges([polygon for polygon, _ in polygons])
+    rows, start, end, span_ids = scanline_spans(edges, ids, nx, ny)
+
+    # the pixels of all spans in one flat index, spans are sorted by polygon
+    # and a flat index array is assigned in order, so the polygon drawn last
+    # wins
+    counts = np.maximum(end - start, 0).astype(np.int32)
+    first = (rows * nx + start - (np.cumsum(counts) - counts)).astype(np.int32)
+    pixels = np.repeat(first, counts) + np.arange(counts.sum(), dtype=np.int32)
+    classes = np.array([idx for _, idx in polygons], dtype=np.uint8)
+    out.ravel()[pixels] = np.repeat(classes[span_ids], counts)
+    return out
+
+
+def burn_outlines(bboxes, nx=256, ny=256):
+    """Burn one pixel wide bounding box outlines into an array of class indices
+
+    :param bboxes: list of ((minx, miny, maxx, maxy), class index) tuple in
+        drawing order, coordinates are in pixels
+    :param nx: image width
+    :param ny: image length
+    :return: (ny, nx) uint8 array, 0 where no outline is burned
+    """
+    out = np.zeros((ny, nx), dtype=np.uint8)
+    for bounds, idx in bboxes:
+        minx, miny, maxx, maxy = np.clip(
+            np.floor(bounds).astype(np.int64), 0, [nx - 1, ny - 1] * 2
+        )
+        out[miny, minx : maxx + 1] = idx
+        out[maxy, minx : maxx + 1] = idx
+        out[miny : maxy + 1, minx] = idx
+        out[miny : maxy + 1, maxx] = idx
+    return out
@@ -0,0 +1,161 @@
+"""
+Incremental reader for large json documents.
+Downloaded ohsome and overpass files keep all of their elements in one array
+of the top level object, e.g. "features" of a geojson FeatureCollection or
+"elements" of an overpass json. The reader yields the elements of that array
+one by one, so only the current element has to be kept in memory instead of
+the whole text and the whole parsed document.
+"""
+import json
+
+CHUNK_SIZE = 1 << 20
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r"
+_delimiters = _whitespace + ",]}"
+
+
+class JSONStreamError(Exception):
+    """json document is not an object or the key is not an array"""
+
+
+class _Buffer(object):
+    """text buffer filled from an iterator of text chunks"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """read next chunk and drop the consumed text, return False at eof"""
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """get next non whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _whitespace:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, chars):
+        """consume next non whitespace character, it must be one of chars"""
+        char = self.peek()
+        if char == "" or char not in chars:
+            raise JSONStreamError(
+                "expect one of {!r}, got {!r}".format(chars, char or "eof")
+            )
+        self.pos += 1
+        return char
+
+    def grow(self):
+        """at least double the pending text, return False at eof"""
+        pending = len(self.text) - self.pos
+        grown = False
+        while len(self.text) - self.pos < 2 * pending or not grown:
+            if not self.fill():
+                break
+            grown = True
+        return grown
+
+    def decode(self):
+        """decode the next json value, read more chunks until it is complete"""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                # incomplete value, retry with a larger part of the text, the
+                # pending text grows exponentially to bound the retries
+                if not self.grow():
+                    raise
+                continue
+            # a number might continue in next chunk, e.g. "0." + "6", it is
+            # complete once a delimiter follows
+            if end == len(self.text) or (
+                isinstance(value, (int, float))
+                and not isinstance(value, bool)
+                and self.text[end] not in _delimiters
+            ):
+                if not self.eof and self.fill():
+                    continue
+            self.pos = end
+            return value
+
+
+def iter_array(chunks, key):
+    """Yield elements of the array stored under key of the top level object
+
+    :param chunks: iterator of text chunks, e.g. from read_chunks
+    :param key: key of the array in the top level json object
+    :return: generator of decoded elements
+    """
+    for _, value in iter_arrays(chunks, (key,)):
+        yield value
+
+
+def iter_arrays(chunks, keys):
+    """Yield (key, element) of the arrays stored under keys of the top level
+    object, in the order of the document
+
+    :param chunks: iterator of text chunks, e.g. from read_chunks
+    :param keys: keys of the arrays in the top level json object
+    :return: generator of (key, decoded element) tuples
+    """
+    buf = _Buffer(chunks)
+    buf.expect("{")
+    if buf.peek() == "}":
+        return
+    while True:
+        name = buf.decode()
+        buf.expect(":")
+        if name in keys:
+            buf.expect("[")
+            if buf.peek() == "]":
+                buf.pos += 1
+            else:
+                while True:
+                    yield name, buf.decode()
+                    if buf.expect(",]") == "]":
+                        break
+        else:
+            # other members are small, e.g. attribution or version
+            buf.decode()
+        if buf.expect(",}") == "}":
+            return
+
+
+def read_chunks(f, size=CHUNK_SIZE):
+    """Read a text file chunk by chunk
+
+    :param f: opened text file
+    :param size: number of characters per chunk
+    """
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_features(fpath):
+    """Yield features of a downloaded geojson FeatureCollection one by one
+
+    :param fpath: path of the geojson file
+    :return: generator of geojson feature dicts
+    """
+    with open(fpath, encoding="utf-8") as f:
+        # single quotes are dropped like the former whole file reader did
+        chunks = (chunk.replace("'", "") for chunk in read_chunks(f))
+        for feature in iter_array(chunks, "features"):
+            yield feature
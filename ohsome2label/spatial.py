@@ -0,0 +1,58 @@
+"""
+Spatial index shared by the overpass downloader and the labelling, it only
+depends on shapely and numpy, so importing it does not load the labelling.
+"""
+import numpy as np
+import shapely
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+
+SHAPELY_2 = int(shapely.__version__.split(".")[0]) >= 2
+
+
+class FeatureIndex(object):
+    """Spatial index over geometries which returns integer positions
+
+    shapely < 2 returns the indexed geometries themselves from a query, they
+    are mapped back to positions by identity, shapely >= 2 returns positions
+    already.
+    """
+
+    def __init__(self, geoms):
+        self._tree = STRtree(geoms)
+        if SHAPELY_2:
+            # object array of the tree, indexed by positions without a copy
+            # of the whole list on every call
+            self._geoms = self._tree.geometries
+            self._ids = None
+        else:
+            self._geoms = geoms
+            self._ids = {id(g): i for i, g in enumerate(geoms)}
+
+    def query(self, geom):
+        """Get sorted positions of geometries whose envelope intersects geom
+
+        :param geom: query geometry
+        :return: list of positions
+        """
+        r = self._tree.query(geom)
+        if self._ids is None:
+            return sorted(r.tolist())
+        return sorted(self._ids[id(g)] for g in r)
+
+    def intersects(self, geom, positions):
+        """Refine query results to the geometries which really intersect geom
+
+        :param geom: query geometry
+        :param positions: positions returned by query
+        :return: list of positions
+        """
+        if len(positions) == 0:
+            return []
+        if SHAPELY_2:
+            shapely.prepare(geom)
+            positions = np.asarray(positions)
+            mask = shapely.intersects(geom, self._geoms[positions])
+            return positions[mask].tolist()
+        prepared = prep(geom)
+        return [i for i in positions if prepared.intersects(self._geoms[i])]
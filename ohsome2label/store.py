@@ -0,0 +1,144 @@
+"""
+Binary feature store for downloaded OSM features.
+Each raw geojson file can be converted into a sibling .npz file which keeps
+the features in columns: WKB geometries and json properties as flat byte
+buffers with offsets, and the lnglat bounds of every feature as a flat
+spatial index. Reading the store only decodes WKB, which is much faster than
+parsing the geojson text again on every label run.
+"""
+import json
+import os
+
+import numpy as np
+from shapely import wkb
+from shapely.geometry import shape
+
+from ohsome2label.reader import iter_features
+
+STORE_EXT = ".npz"
+
+
+def store_path(fpath):
+    """get the path of the feature store of a raw geojson file"""
+    return os.path.splitext(fpath)[0] + STORE_EXT
+
+
+def write_store(fpath, features):
+    """Write features into a feature store
+
+    :param fpath: path of the store
+    :param features: iterable of (shapely geometry, properties) tuple
+    :return: number of stored features
+    """
+    geoms = bytearray()
+    geom_offsets = [0]
+    props = bytearray()
+    prop_offsets = [0]
+    bounds = []
+    for geom, properties in features:
+        geoms += geom.wkb
+        geom_offsets.append(len(geoms))
+        props += json.dumps(properties, ensure_ascii=False).encode("utf-8")
+        prop_offsets.append(len(props))
+        bounds.append(geom.bounds)
+
+    # write to a temporary file first, an interrupted run must not leave a
+    # store behind which looks newer than its geojson file
+    tmp_path = fpath + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            geoms=np.frombuffer(bytes(geoms), dtype=np.uint8),
+            geom_offsets=np.array(geom_offsets, dtype=np.int64),
+            props=np.frombuffer(bytes(props), dtype=np.uint8),
+            prop_offsets=np.array(prop_offsets, dtype=np.int64),
+            bounds=np.array(bounds, dtype=np.float64).reshape(-1, 4),
+        )
+    os.replace(tmp_path, fpath)
+    return len(bounds)
+
+
+class FeatureStore(object):
+    """Read features from a feature store"""
+
+    def __init__(self, fpath):
+        with np.load(fpath) as data:
+            self._geoms = data["geoms"].tobytes()
+            self._geom_offsets = data["geom_offsets"]
+            self._props = data["props"].tobytes()
+            self._prop_offsets = data["prop_offsets"]
+            self.bounds = data["bounds"]
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def geometry(self, i):
+        """get shapely geometry of feature i"""
+        start, end = self._geom_offsets[i], self._geom_offsets[i + 1]
+        return wkb.loads(self._geoms[start:end])
+
+    def properties(self, i):
+        """get properties of feature i"""
+        start, end = self._prop_offsets[i], self._prop_offsets[i + 1]
+        return json.loads(self._props[start:end].decode("utf-8"))
+
+    def query(self, bbox):
+        """get positions of features whose bounds intersect a lnglat bbox
+
+        :param bbox: Bbox tuple
+        :return: array of positions
+        """
+        b = self.bounds
+        mask = (
+            (b[:, 0] <= bbox.east)
+            & (b[:, 2] >= bbox.west)
+            & (b[:, 1] <= bbox.north)
+            & (b[:, 3] >= bbox.south)
+        )
+        return np.nonzero(mask)[0]
+
+    def iter(self, bbox=None):
+        """Yield (shapely geometry, properties) of the features
+
+        :param bbox: only yield features intersecting this lnglat Bbox
+        """
+        if bbox is None:
+            positions = range(len(self))
+        else:
+            positions = self.query(bbox)
+        for i in positions:
+            yield self.geometry(i), self.properties(i)
+
+
+def read_features(fpath, bbox=None):
+    """Yield (shapely geometry, properties) of a raw geojson file, from its
+    feature store if the store is up to date
+
+    :param fpath: path of the raw geojson file
+    :param bbox: Bbox to filter the features of a store
+    """
+    spath = store_path(fpath)
+    if os.path.exists(spath) and (
+        not os.path.exists(fpath) or os.path.getmtime(spath) >= os.path.getmtime(fpath)
+    ):
+        for geom, properties in FeatureStore(spath).iter(bbox):
+            yield geom, properties
+    else:
+        for feature in iter_features(fpath):
+            yield shape(feature["geometry"]), feature["properties"]
+
+
+def convert_raw(workspace):
+    """Convert every raw geojson file of the workspace into a feature store
+
+    :param workspace: workspace
+    """
+    for fname in sorted(os.listdir(workspace.raw)):
+        if not fname.endswith(".geojson"):
+            continue
+        fpath = os.path.join(workspace.raw, fname)
+        features = (
+            (shape(feature["geometry"]), feature["properties"])
+            for feature in iter_features(fpath)
+        )
+        write_store(store_path(fpath), features)
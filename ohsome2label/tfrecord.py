@@ -0,0 +1,177 @@
+"""
+TFRecord writer without tensorflow.
+tf.train.Example messages are encoded by hand, they only need the varint
+and length delimited wire types of protocol buffers. Records are framed
+like tf.io.TFRecordWriter does: length, masked crc32c of the length, data
+and masked crc32c of the data.
+The crc32c comes from the crc32c package when it is installed, otherwise
+it is computed byte by byte with a lookup table. open_writer uses the
+writer of tensorflow when it is installed.
+"""
+import importlib.util
+import struct
+
+try:
+    # optional C implementation
+    from crc32c import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+_POLY = 0x82F63B78
+_MASK_DELTA = 0xA282EAD8
+
+
+def _make_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ _POLY if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_TABLE = _make_table()
+
+
+def _update(crc, data):
+    """advance the crc register over data byte by byte"""
+    table = _TABLE
+    for b in data:
+        crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+def crc32c(data):
+    """Get the crc32c (Castagnoli) checksum of bytes"""
+    if _crc32c is not None:
+        return _crc32c(data)
+    return _update(0xFFFFFFFF, data) ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data):
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + _MASK_DELTA) & 0xFFFFFFFF
+
+
+def _varint(value):
+    value &= 0xFFFFFFFFFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, payload):
+    """length delimited field"""
+    return _varint((number << 3) | 2) + _varint(len(payload)) + payload
+
+
+def bytes_feature(values):
+    """Feature with a BytesList of a bytes or a list of bytes"""
+    if isinstance(values, bytes):
+        values = [values]
+    return _field(1, b"".join(_field(1, v) for v in values))
+
+
+def float_feature(values):
+    """Feature with a packed FloatList of a float or a list of floats"""
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    payload = struct.pack("<{}f".format(len(values)), *values)
+    return _field(2, _field(1, payload) if values else b"")
+
+
+def int64_feature(values):
+    """Feature with a packed Int64List of an int or a list of ints"""
+    if not isinstance(values, (list, tuple)):
+        values = [values]
+    payload = b"".join(_varint(int(v)) for v in values)
+    return _field(3, _field(1, payload) if values else b"")
+
+
+def encode_example(features):
+    """Encode a tf.train.Example
+
+    :param features: dict of feature name -> encoded feature, e.g. from
+        bytes_feature, float_feature or int64_feature
+    :return: serialized Example
+    """
+    entries = b"".join(
+        _field(1, _field(1, key.encode("utf-8")) + _field(2, value))
+        for key, value in sorted(features.items())
+    )
+    return _field(1, entries)
+
+
+def frame_record(data):
+    """Frame a serialized record for a TFRecord file"""
+    length = struct.pack("<Q", len(data))
+    return (
+        length
+        + struct.pack("<I", masked_crc32c(length))
+        + data
+        + struct.pack("<I", masked_crc32c(data))
+    )
+
+
+def iter_records(f):
+    """Yield the records of an opened TFRecord file, the checksums are
+    verified"""
+    while True:
+        header = f.read(12)
+        if not header:
+            return
+        length, length_crc = struct.unpack("<QI", header)
+        if masked_crc32c(header[:8]) != length_crc:
+            raise ValueError("corrupted record length")
+        data = f.read(length)
+        (data_crc,) = struct.unpack("<I", f.read(4))
+        if masked_crc32c(data) != data_crc:
+            raise ValueError("corrupted record data")
+        yield data
+
+
+class RecordWriter(object):
+    """Write framed records into a TFRecord file"""
+
+    def __init__(self, path):
+        self.f = open(path, "wb")
+
+    def write(self, record):
+        self.f.write(frame_record(record))
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def fast_checksums():
+    """check if the crc32c package or tensorflow computes the checksums,
+    otherwise records are checksummed byte by byte in python"""
+    return _crc32c is not None or importlib.util.find_spec("tensorflow") is not None
+
+
+def open_writer(path):
+    """Open a TFRecord file for writing, with tf.io.TFRecordWriter if
+    tensorflow is installed, otherwise with RecordWriter
+
+    :param path: path of the TFRecord file
+    :return: writer with write(record) and close()
+    """
+    try:
+        # imported here, importing tensorflow takes seconds
+        import tensorflow as tf
+    except ImportError:
+        return RecordWriter(path)
+    return tf.io.TFRecordWriter(path)
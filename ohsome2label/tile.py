@@ -16,6 +16,8 @@ To calculate the tile number in TMS according to the tile number in SMT
 import math
 from collections import namedtuple
 
+import numpy as np
+
 ELLIPSOID = 6378137.0
 XMAX = YMAX = math.pi * ELLIPSOID
 XMIN = YMIN = -XMAX
@@ -54,6 +56,19 @@ def truncate(lon, lat):
     return lon, lat
 
 
+def truncate_array(lon, lat):
+    """truncate arrays of longitude and latitude.
+
+    :param lon: longitude array
+    :param lat: latitude array
+
+    :return: truncated longitude and latitude arrays
+    """
+    lon = np.clip(np.asarray(lon, dtype=float), -180.0, 180.0)
+    lat = np.clip(np.asarray(lat, dtype=float), LATMIN, LATMAX)
+    return lon, lat
+
+
 def truncate_xy(x, y):
     """truncate the x/y coordinate according to the EPSG:3857 definition
 
@@ -87,6 +102,20 @@ def xy(lon, lat):
     return x, y
 
 
+def xy_array(lon, lat):
+    """Convert arrays of EPSG:4326 coordinates to EPSG:3857.
+
+    :param lon: longitude array
+    :param lat: latitude array
+    :return: EPSG:3857 x and y arrays
+    """
+    lon, lat = truncate_array(lon, lat)
+    x = ELLIPSOID * np.radians(lon)
+    y = ELLIPSOID * \
+        np.log(np.tan((0.25 * math.pi) + (0.5 * np.radians(lat))))
+    return x, y
+
+
 def lnglat(x, y):
     """Convert EPSG:3857 to EPSG:4326.
 
@@ -217,6 +246,32 @@ def tiles(bbox, zoom):
             yield Tile(x, y, zoom)
 
 
+def chunk_bboxes(bbox, zoom, chunk_size):
+    """Split a lnglat bounding box into a grid of tile aligned bounding boxes
+
+    :param bbox: bounding box in lnglat
+    :param zoom: zoom level
+    :param chunk_size: width and height of a chunk in tiles
+    :return: generator of the chunk bounding boxes, clipped to bbox
+    """
+    min_tx, min_ty, _ = lnglat_to_tile(bbox.west, bbox.north, zoom)
+    max_tx, max_ty, _ = lnglat_to_tile(bbox.east, bbox.south, zoom)
+    for x in range(min_tx, max_tx + 1, chunk_size):
+        for y in range(min_ty, max_ty + 1, chunk_size):
+            west, north = west_north(Tile(x, y, zoom))
+            east, south = west_north(
+                Tile(min(x + chunk_size, max_tx + 1), min(y + chunk_size, max_ty + 1), zoom)
+            )
+            chunk = Bbox(
+                max(west, bbox.west),
+                max(south, bbox.south),
+                min(east, bbox.east),
+                min(north, bbox.north),
+            )
+            if chunk.west < chunk.east and chunk.south < chunk.north:
+                yield chunk
+
+
 def xy_expand_bbox(bbox, zoom):
     """Expand bounding box cover all related tile in EPSG:3857
 
@@ -297,3 +352,18 @@ def apply_transform(coords, trans):
     coords = [((x - trans[0]) / trans[1], (y - trans[3]) / trans[5])
               for x, y in coords]
     return coords
+
+
+def apply_transform_array(coords, trans):
+    """transform an (n, 2) coordinate array according transformation matrix to
+    get image-based local coordinate
+
+    :param coords: coordinate array
+    :param trans: translation to get image-based coordinate system coordinate
+    :return: (n, 2) array
+    """
+    coords = np.asarray(coords, dtype=float)
+    out = np.empty((len(coords), 2))
+    out[:, 0] = (coords[:, 0] - trans[0]) / trans[1]
+    out[:, 1] = (coords[:, 1] - trans[3]) / trans[5]
+    return out
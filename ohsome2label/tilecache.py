@@ -0,0 +1,160 @@
+"""
+Local image tile cache shared across projects.
+Tiles are stored once by the sha256 of their content under objects/, an
+sqlite index maps (provider, z, x, y, url template hash) to the content and
+keeps the last access time for LRU eviction. Workspaces get hardlinks (or
+copies across filesystems) of the cached files instead of downloading the
+same tiles again. Cache and workspaces never refer to each other by path, so
+evicting a tile or deleting a workspace does not break the other side.
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from ohsome2label.utils import file_hash, valid_image
+
+
+def link_file(src, dst):
+    """hardlink src to dst, replacing dst, fall back to a copy"""
+    tmp = dst + ".link"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        # e.g. cache and workspace are on different filesystems
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class TileCache(object):
+    """Content addressed tile cache
+
+    :param root: directory of the cache
+    :param max_size: maximum size of the cached files in bytes, 0 for no limit
+    """
+
+    def __init__(self, root, max_size=0):
+        self.root = root
+        self.max_size = max_size
+        self.objects = os.path.join(root, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), timeout=60, check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tiles ("
+                "key TEXT PRIMARY KEY, digest TEXT, size INTEGER, atime REAL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS tiles_digest ON tiles (digest)"
+            )
+
+    @staticmethod
+    def key(provider, tile, url_template):
+        """get the cache key of a tile
+
+        :param provider: image api, e.g. bing
+        :param tile: tile tuple
+        :param url_template: image url template, the token is not filled in
+        """
+        template = hashlib.sha1(url_template.encode("utf-8")).hexdigest()[:16]
+        return "{}/{}/{}/{}/{}".format(provider, tile.z, tile.x, tile.y, template)
+
+    def _object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def get(self, key, fpath):
+        """link a cached tile to fpath
+
+        :param key: cache key of the tile
+        :param fpath: target path in the workspace
+        :return: size of the tile, None if it is not cached or cannot be
+            decoded
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest, size FROM tiles WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            digest, size = row
+            path = self._object_path(digest)
+            if not os.path.exists(path):
+                with self._db:
+                    self._db.execute("DELETE FROM tiles WHERE key = ?", (key,))
+                return None
+            if not valid_image(path):
+                # e.g. an error page cached by an older version
+                with self._db:
+                    self._db.execute("DELETE FROM tiles WHERE digest = ?", (digest,))
+                os.remove(path)
+                return None
+            with self._db:
+                self._db.execute(
+                    "UPDATE tiles SET atime = ? WHERE key = ?", (time.time(), key)
+                )
+        link_file(path, fpath)
+        return size
+
+    def put(self, key, fpath):
+        """add a downloaded tile to the cache
+
+        :param key: cache key of the tile
+        :param fpath: path of the downloaded tile
+        """
+        digest = file_hash(fpath)
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            link_file(fpath, path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+                (key, digest, os.path.getsize(path), time.time()),
+            )
+
+    def size(self):
+        """get the size of all cached files in bytes"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT SUM(size) FROM "
+                "(SELECT digest, MAX(size) AS size FROM tiles GROUP BY digest)"
+            ).fetchone()
+        return row[0] or 0
+
+    def evict(self):
+        """remove least recently used tiles until the cache fits max_size
+
+        :return: number of removed files
+        """
+        if not self.max_size:
+            return 0
+        total = self.size()
+        removed = 0
+        with self._lock:
+            # a file is as recent as the most recent tile refering to it
+            rows = self._db.execute(
+                "SELECT digest, MAX(size), MAX(atime) AS atime FROM tiles "
+                "GROUP BY digest ORDER BY atime"
+            ).fetchall()
+            for digest, size, _ in rows:
+                if total <= self.max_size:
+                    break
+                with self._db:
+                    self._db.execute("DELETE FROM tiles WHERE digest = ?", (digest,))
+                path = self._object_path(digest)
+                if os.path.exists(path):
+                    os.remove(path)
+                total -= size
+                removed += 1
+        return removed
+
+    def close(self):
+        self.evict()
+        self._db.close()
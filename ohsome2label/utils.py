@@ -1,6 +1,13 @@
+import hashlib
+import json
 import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 
 import numpy as np
+from PIL import Image
 from requests import exceptions
 from requests.models import HTTPError
 from urllib3.util.retry import Retry
@@ -9,11 +16,18 @@ import time
 import logging
 import tqdm
 
-from ohsome2label.tile import Tile, get_xy_bbox
+from ohsome2label.reader import CHUNK_SIZE, iter_array, read_chunks
+from ohsome2label.tile import Tile, chunk_bboxes, get_xy_bbox
 
 
 log = logging.getLogger(__name__)
 
+# record of image downloads in workspace.other, one json line per tile
+IMAGE_MANIFEST = "image_manifest.jsonl"
+# connect and read timeout of downloads in seconds, the read timeout is the
+# longest wait for the next bytes, not for the whole response
+TIMEOUT = (30, 300)
+
 
 class RequestError(Exception):
     """Cannot download from that URL"""
@@ -28,25 +42,99 @@ def get_area(x, y):
     return 0.5 * np.abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
 
 
-def retries_session(retries=0):
+def file_hash(fpath, chunk_size=1 << 20):
+    """Calculate the sha256 hex digest of a file
+
+    param fpath: path of the file
+    param chunk_size: number of bytes read at once
+    """
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def retries_session(retries=0, pool_size=10):
     session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(max_retries=retries)
+    adapter = requests.adapters.HTTPAdapter(
+        max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size
+    )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
     return session
 
 
-def download(fpath, api, params={}, retries=0):
-    """Download with url and params"""
-    session = retries_session(retries)
+class HostSessions(object):
+    """Shared sessions for concurrent downloads, one connection pool per host,
+    so connections are reused between tiles."""
+
+    def __init__(self, retries=0, pool_size=10):
+        self.retries = retries
+        self.pool_size = pool_size
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """get the session of the host of url"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._sessions:
+                self._sessions[host] = retries_session(self.retries, self.pool_size)
+            return self._sessions[host]
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+
+
+class RateLimiter(object):
+    """Limit the number of requests per second of every host"""
+
+    def __init__(self, rate=0):
+        self.interval = 1.0 / rate if rate else 0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """block until a request to the host of url is allowed"""
+        if not self.interval:
+            return
+        host = urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+        delay = start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def download(fpath, api, params={}, retries=0, session=None, timeout=TIMEOUT):
+    """Download with url and params
+    The response is written to a temporary file which is renamed to fpath
+    afterwards, so an interrupted download never leaves a truncated file.
+
+    param session: shared session, a new one is created if it is None
+    param timeout: (connect, read) timeout in seconds
+    return: number of written bytes, None if the download failed
+    """
+    if session is None:
+        session = retries_session(retries)
+    tmp_path = fpath + ".part"
+    r = None
     # if r.status_code == 200:
     try:
-        r = session.get(url=api, params=params)
-        if not r.raise_for_status():
-            with open(fpath, "wb") as f:
-                f.write(r.content)
-        else:
-            raise requests.exceptions.HTTPError
+        # stream the body to disk, so memory does not grow with the response
+        r = session.get(url=api, params=params, stream=True, timeout=timeout)
+        r.raise_for_status()
+        size = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, fpath)
+        return size
     except requests.exceptions.HTTPError as e:
         # log.error("Retry execced max time, please check API or try it later")
         log.warning(
@@ -55,39 +143,213 @@ def download(fpath, api, params={}, retries=0):
     except requests.exceptions.ConnectionError as e:
         # log.error("ConnectionError, please check API")
         log.warning("Connection error. %s" % e)
+    except requests.exceptions.RequestException as e:
+        # e.g. the body was cut off or timed out while streaming
+        log.warning("Download error. %s" % e)
+    finally:
+        # release the connection to the pool of the shared session
+        if r is not None:
+            r.close()
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return None
+
+
+def ohsome_filter(tag, types):
+    """generate ohsome filter of a tag
+
+    param tag: label tag
+    param types: geometry type, e.g. polygon
+    """
+    if tag["value"] != '':
+        return "{}={} and geometry:{}".format(tag["key"], tag["value"], types)
+    else:
+        return "{}=* and geometry:{}".format(tag["key"], types)
+
 
+def combined_filter(tags, types):
+    """generate one ohsome filter matching any of the tags
 
-def download_osm(cfg, workspace):
+    param tags: label tags
+    param types: geometry type, e.g. polygon
+    """
+    parts = []
+    for tag in tags:
+        if tag["value"] != '':
+            part = "{}={}".format(tag["key"], tag["value"])
+        else:
+            part = "{}=*".format(tag["key"])
+        if part not in parts:
+            parts.append(part)
+    return "({}) and geometry:{}".format(" or ".join(parts), types)
+
+
+def ohsome_queries(cfg):
+    """get the ohsome requests of the config
+
+    param cfg: config from config.yaml
+    return: list of (file name, filter) tuple
+    """
+    if cfg.combine:
+        return [("ohsome_query.geojson", combined_filter(cfg.tags, cfg.types))]
+    queries = []
+    for tag in cfg.tags:
+        fname = "{label}_{k}_{v}.geojson".format(
+            label=tag["label"], k=tag["key"], v=tag["value"]
+        )
+        queries.append((fname, ohsome_filter(tag, cfg.types)))
+    return queries
+
+
+def ohsome_properties(cfg, *extra):
+    """get ohsome properties parameter of the config plus extra properties"""
+    properties = list(cfg.properties or [])
+    # labels of a combined request are assigned from the feature tags
+    if cfg.combine:
+        extra = ("tags",) + extra
+    for prop in extra:
+        if prop not in properties:
+            properties.append(prop)
+    return ",".join(properties) or None
+
+
+def download_osm(cfg, workspace, chunk_size=0, workers=1):
     """Download osm according to config
+    By default there is one request per tag, with combine in the config all
+    tags are downloaded by one request and labelled from their tags.
 
     param cfg: config from config.yaml
     param workspace: workspace to store osm data
+    param chunk_size: split the bboxes into chunks of chunk_size x chunk_size
+                      tiles, 0 to request the whole bboxes at once
+    param workers: number of concurrent requests of chunks
     """
+    if chunk_size > 0:
+        download_osm_chunks(cfg, workspace, chunk_size, workers)
+        return
+
     url = cfg.url
     params = {
         "bboxes": "{},{},{},{}".format(*cfg.bboxes),
         "time": cfg.timestamp,
         # "types": cfg.types,
-        "properties": cfg.properties,
+        "properties": ohsome_properties(cfg),
     }
     tgt_dir = workspace.raw
-    for tag in tqdm.tqdm(cfg.tags):
-        fname = "{label}_{k}_{v}.geojson".format(
-            label=tag["label"], k=tag["key"], v=tag["value"]
-        )
+    for fname, _filter in tqdm.tqdm(ohsome_queries(cfg)):
         # params["keys"] = tag["key"]
         # params["values"] = tag["value"]
-        if tag["value"] != '':
-            params["filter"] = "{}={} and geometry:{}".format(
-                tag["key"], tag["value"], cfg.types)
-        else:
-            params["filter"] = "{}=* and geometry:{}".format(
-                tag["key"], cfg.types)
+        params["filter"] = _filter
         fpath = os.path.join(tgt_dir, fname)
         download(fpath, url, params)
 
 
-def download_img(cfg, workspace):
+def download_osm_chunks(cfg, workspace, chunk_size, workers=1):
+    """Download osm in tile aligned chunks of the bboxes concurrently
+    Every (request, chunk) is one request. Geometries are requested unclipped,
+    so features crossing chunk edges are identical in every chunk and merged
+    by their @osmId.
+
+    param cfg: config from config.yaml
+    param workspace: workspace to store osm data
+    param chunk_size: width and height of a chunk in tiles
+    param workers: number of concurrent requests
+    raise: RequestError if a chunk failed
+    """
+    url = cfg.url
+    properties = ohsome_properties(cfg, "unclipped")
+    chunks = list(chunk_bboxes(cfg.bboxes, cfg.zoom, chunk_size))
+    chunk_dir = os.path.join(workspace.raw, "chunks")
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    queries = ohsome_queries(cfg)
+    jobs = []
+    for fname, _filter in queries:
+        for i, chunk in enumerate(chunks):
+            params = {
+                "bboxes": "{},{},{},{}".format(*chunk),
+                "time": cfg.timestamp,
+                "properties": properties,
+                "filter": _filter,
+            }
+            chunk_name = "{}.{}.geojson".format(os.path.splitext(fname)[0], i)
+            jobs.append((fname, os.path.join(chunk_dir, chunk_name), params))
+
+    sessions = HostSessions(pool_size=workers)
+
+    def _download(job):
+        _, fpath, params = job
+        return download(fpath, url, params, session=sessions.get(url))
+
+    print("Download {} requests in {} chunks".format(len(queries), len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        sizes = list(tqdm.tqdm(executor.map(_download, jobs), total=len(jobs)))
+    sessions.close()
+
+    failed = [fpath for (_, fpath, _), size in zip(jobs, sizes) if size is None]
+    if failed:
+        # keep the chunks, an incomplete merge would look like a complete file
+        log.warning("%d chunks failed, the chunks are not merged" % len(failed))
+        raise RequestError("{} of {} chunks failed".format(len(failed), len(jobs)))
+
+    for fname, _ in queries:
+        paths = [fpath for _fname, fpath, _ in jobs if _fname == fname]
+        merge_features(paths, os.path.join(workspace.raw, fname))
+        for fpath in paths:
+            os.remove(fpath)
+    if not os.listdir(chunk_dir):
+        os.rmdir(chunk_dir)
+
+
+def merge_features(paths, fpath):
+    """Merge geojson FeatureCollections feature by feature, features with an
+    @osmId which is already written are dropped
+
+    param paths: paths of the geojson files
+    param fpath: path of the merged geojson file
+    return: number of merged features
+    """
+
+    def _features():
+        seen = set()
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for feature in iter_array(read_chunks(f), "features"):
+                    osm_id = feature.get("properties", {}).get("@osmId")
+                    if osm_id is not None:
+                        if osm_id in seen:
+                            continue
+                        seen.add(osm_id)
+                    yield feature
+
+    return write_features(fpath, _features())
+
+
+def write_features(fpath, features):
+    """Write features into a geojson FeatureCollection one by one
+
+    param fpath: path of the geojson file
+    param features: iterable of geojson features
+    return: number of written features
+    """
+    count = 0
+    tmp_path = fpath + ".part"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        out.write('{"type": "FeatureCollection", "features": [')
+        for feature in features:
+            if count:
+                out.write(",")
+            out.write("\n")
+            json.dump(feature, out, ensure_ascii=False)
+            count += 1
+        out.write("\n]}\n")
+    os.replace(tmp_path, fpath)
+    return count
+
+
+def download_img(
+    cfg, workspace, workers=1, rate=0, retries=0, resume=False, cache=None
+):
     """download satellite image
     different api has different RESTful api url,
     Now we support mapbox/sentinel/bing/custom
@@ -102,6 +364,11 @@ def download_img(cfg, workspace):
 
     param cfg: ohsome2label.config.o2l_config
     param workspace: ohsome2label.config.workspace
+    param workers: number of concurrent downloads
+    param rate: maximum requests per second of every host, 0 for no limit
+    param retries: retries of a failed connection
+    param resume: skip images which are already downloaded and valid
+    param cache: ohsome2label.tilecache.TileCache shared across projects
     """
     tgt_dir = workspace.tmp
     tile_list = os.path.join(workspace.other, "tile_list")
@@ -109,31 +376,105 @@ def download_img(cfg, workspace):
     with open(tile_list, "r") as tl:
         tiles = [_.replace("\n", "") for _ in tl]
     api = cfg.img_api.lower()
-    for tile in tqdm.tqdm(tiles):
+    downloads = []
+    for tile in tiles:
         z, x, y = [int(_) for _ in tile.split(".")]
         tile = Tile(x, y, z)
-        baseURL = cfg.img_url
-        if api == "mapbox":
-            url = baseURL.format(x=tile.x, y=tile.y, z=tile.z, token=cfg.token)
-        elif api == "sentinel":
-            bbox = "{},{},{},{}".format(*get_xy_bbox(tile))
-            url = baseURL.format(token=cfg.token, bbox=bbox)
-        elif api == "bing":
-            quadkey = tile_coords_and_zoom_to_quadKey(int(x), int(y), int(z))
-            url = baseURL.format(q=quadkey, token=cfg.token)
-        elif api == "custom":
-            if "token" in baseURL:
-                url = baseURL.format(x=tile.x, y=tile.y,
-                                     z=tile.z, token=cfg.token)
-            else:
-                url = baseURL.format(x=tile.x, y=tile.y, z=tile.z)
-
+        url = tile_url(cfg, tile)
         if api == "sentinel":
             fname = "{0.z}.{0.x}.{0.y}.tiff".format(tile)
         else:
             fname = "{0.z}.{0.x}.{0.y}.png".format(tile)
         fpath = os.path.join(tgt_dir, fname)
-        download(fpath, url)
+        downloads.append((fpath, url, tile))
+
+    sessions = HostSessions(retries=retries, pool_size=workers)
+    limiter = RateLimiter(rate)
+
+    def _download(job):
+        fpath, url, tile = job
+        if resume and valid_image(fpath):
+            return "exists", os.path.getsize(fpath)
+        if cache is not None:
+            key = cache.key(api, tile, cfg.img_url)
+            size = cache.get(key, fpath)
+            if size is not None:
+                return "cached", size
+        limiter.wait(url)
+        size = download(fpath, url, session=sessions.get(url))
+        if size is None:
+            return "failed", 0
+        # e.g. an empty body or an html error page sent with status 200
+        if not valid_image(fpath):
+            log.warning("Invalid image %s from %s" % (fpath, url))
+            os.remove(fpath)
+            return "failed", 0
+        if cache is not None:
+            cache.put(key, fpath)
+        return "ok", size
+
+    manifest_path = os.path.join(workspace.other, IMAGE_MANIFEST)
+    status = defaultdict(int)
+    with open(manifest_path, "a", encoding="utf-8") as manifest:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_download, downloads)
+            for (fpath, url, _), (state, size) in tqdm.tqdm(
+                zip(downloads, results), total=len(downloads)
+            ):
+                status[state] += 1
+                record = {
+                    "file": os.path.basename(fpath),
+                    "url": url,
+                    "status": state,
+                    "bytes": size,
+                }
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+    sessions.close()
+    print(
+        "Images: {} downloaded, {} from cache, {} already present, {} failed".format(
+            status["ok"], status["cached"], status["exists"], status["failed"]
+        )
+    )
+
+
+def valid_image(fpath):
+    """check if an image file exists, is not empty and can be decoded
+
+    param fpath: path of the image
+    """
+    if not os.path.isfile(fpath) or os.path.getsize(fpath) == 0:
+        return False
+    try:
+        with Image.open(fpath) as img:
+            img.verify()
+    except Exception:
+        return False
+    return True
+
+
+def tile_url(cfg, tile):
+    """get the image url of a tile
+
+    param cfg: ohsome2label.config.o2l_config
+    param tile: tile tuple
+    """
+    api = cfg.img_api.lower()
+    baseURL = cfg.img_url
+    if api == "mapbox":
+        url = baseURL.format(x=tile.x, y=tile.y, z=tile.z, token=cfg.token)
+    elif api == "sentinel":
+        bbox = "{},{},{},{}".format(*get_xy_bbox(tile))
+        url = baseURL.format(token=cfg.token, bbox=bbox)
+    elif api == "bing":
+        quadkey = tile_coords_and_zoom_to_quadKey(tile.x, tile.y, tile.z)
+        url = baseURL.format(q=quadkey, token=cfg.token)
+    elif api == "custom":
+        if "token" in baseURL:
+            url = baseURL.format(x=tile.x, y=tile.y, z=tile.z, token=cfg.token)
+        else:
+            url = baseURL.format(x=tile.x, y=tile.y, z=tile.z)
+    return url
 
 
 def valid_coco():
@@ -4,9 +4,11 @@ import numpy as np
 from PIL import Image
 
 
-def load_image(infilename):
+def load_image(infilename, mode=None):
     img = Image.open(infilename)
     img.load()
+    if mode is not None and img.mode != mode:
+        img = img.convert(mode)
     data = np.asarray(img)
     return data
 
@@ -25,7 +27,8 @@ def visualize_combined(workspace, num):
         f_img = os.path.join(img_dir, file)
         f_label = os.path.join(label_dir, file)
         imagery = load_image(f_img)
-        label = load_image(f_label)
+        # single channel labels are expanded to their palette colors
+        label = load_image(f_label, "RGB")
         combined = np.hstack((imagery, label))
         combined_image = Image.fromarray(combined)
         f_preview = os.path.join(preview_dir, file)
@@ -37,6 +37,8 @@ setup(
     python_requires=">=3.6",
     py_module=['main'],
     install_requires=install_requires,
+    # fast checksums of TFRecord shards
+    extras_require={'tfrecord': ['crc32c']},
     long_description=readme,
     long_description_content_type="text/markdown",
     entry_points="""
@@ -0,0 +1,38 @@
+import json
+
+from ohsome2label.coco import CocoIndex, read_coco
+
+
+def test_coco_index(tmp_path):
+    images = [{"id": i, "width": 256, "height": 256, "file_name": "{}.png".format(i)}
+              for i in (7, 3, 5)]
+    annos = [
+        {"id": 1, "image_id": 5, "category_id": 2, "bbox": [4, 4, 0, 0], "area": 8.0,
+         "iscrowd": 0, "segmentation": [[0, 0, 4, 0, 4, 4], [1, 1, 2, 1, 2, 2]]},
+        {"id": 2, "image_id": 7, "category_id": 1, "bbox": [9, 9, 1, 1], "area": 32.0,
+         "iscrowd": 0, "segmentation": [[1, 1, 9, 1, 9, 9, 1, 9]]},
+        {"id": 3, "image_id": 5, "category_id": 1, "bbox": [3, 3, 1, 1], "area": 2.0,
+         "iscrowd": 0, "segmentation": [[1, 1, 3, 1, 3, 3]]},
+        {"id": 4, "image_id": 99, "category_id": 1, "bbox": [3, 3, 1, 1], "area": 2.0,
+         "iscrowd": 0, "segmentation": []},
+    ]
+    coco = {"images": images, "annotations": annos,
+            "categories": [{"id": 1, "name": "urban"}, {"id": 2, "name": "industry"}]}
+    fpath = str(tmp_path / "geococo.json")
+    with open(fpath, "w") as f:
+        json.dump(coco, f)
+
+    index = read_coco(fpath, save=True)
+    assert len(index) == 3
+    assert index.ann_ids.tolist() == [2, 1, 3]
+    assert index.coords.shape == (26,)
+    pos = index.position(5)
+    assert index.image(pos) == images[2]
+    anns = index.annotations(pos)
+    assert index.ann_ids[anns].tolist() == [1, 3]
+    assert index.annotations(index.position(3)) == slice(1, 1)
+    assert index.category_name(int(index.category_ids[anns][0])) == "industry"
+    assert index.annotation(anns.start) == annos[0]
+
+    loaded = CocoIndex.load(str(tmp_path / "geococo.npz"))
+    assert [loaded.annotation(j) for j in range(3)] == [annos[1], annos[0], annos[2]]
@@ -0,0 +1,112 @@
+import json
+import os
+import tarfile
+
+import numpy as np
+from PIL import Image
+
+from ohsome2label.config import Parser, workspace
+from ohsome2label.export import (
+    PackedTiles,
+    balance_shards,
+    export_shards,
+    pack_tiles,
+    split_shards,
+)
+from ohsome2label.label import geococo
+from ohsome2label.palette import palette
+from ohsome2label.raster import hex_to_rgb
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_pack_tiles_round_trip(tmp_path):
+    cfg = Parser(
+        os.path.join(ROOT, "config", "config.yaml"),
+        os.path.join(ROOT, "config", "schema.yaml"),
+    ).parse()
+    ws = workspace(str(tmp_path))
+    pal = palette(cfg.tags, os.path.join(ws.other, "colors"))
+    catIdxs = geococo(cfg).catIdxs
+
+    index = np.zeros((256, 256), dtype=np.uint8)
+    index[10:100, 20:200] = catIdxs["urban"]
+    index[150:, :50] = catIdxs["industry"]
+    lut = np.zeros((3, 3), dtype=np.uint8)
+    for label, idx in catIdxs.items():
+        lut[idx] = hex_to_rgb(pal.color(label))
+    image = np.random.RandomState(0).randint(0, 255, (256, 256, 3), dtype=np.uint8)
+    # one rgb label with image, one indexed label without image
+    Image.fromarray(lut[index]).save(os.path.join(ws.label, "14.2.1.png"))
+    Image.fromarray(image).save(os.path.join(ws.img, "14.2.1.png"))
+    Image.fromarray(index[::-1]).save(os.path.join(ws.label, "14.10.1.png"))
+
+    assert pack_tiles(cfg, ws) == 2
+    packed = PackedTiles(ws.export)
+    assert len(packed) == 2
+    assert packed.tiles.tolist() == [[14, 2, 1], [14, 10, 1]]
+    assert packed.meta["missing_images"] == ["14.10.1"]
+
+    images, labels = packed[:]
+    assert isinstance(labels, np.memmap)
+    np.testing.assert_array_equal(labels[0], index)
+    np.testing.assert_array_equal(labels[packed.index("14.10.1")], index[::-1])
+    np.testing.assert_array_equal(images[0], image)
+    assert not images[1].any()
+
+
+def test_balance_shards():
+    assert balance_shards([5, 1, 4, 3, 3], 2) == [0, 1, 1, 1, 0]
+
+
+def test_split_shards():
+    # 80/20 split of 4 shards, the val split keeps its one shard
+    assert split_shards([80, 20], [100, 100], 4) == [3, 1]
+    assert split_shards([50, 50], [100, 100], 5) == [3, 2]
+    # a split never gets more shards than tiles
+    assert split_shards([90, 10], [100, 1], 6) == [5, 1]
+    assert split_shards([90, 10], [2, 1], 6) == [2, 1]
+    # too few shards for both splits
+    assert split_shards([80, 20], [100, 100], 1) == [1, 1]
+
+
+def test_export_shards(tmp_path):
+    ws = workspace(str(tmp_path))
+    images = []
+    for i in range(5):
+        name = "14.{}.1.png".format(i)
+        images.append({"id": i, "file_name": name, "width": 256, "height": 256})
+        if i != 4:
+            Image.new("RGB", (256, 256), (i, 0, 0)).save(os.path.join(ws.img, name))
+            Image.new("P", (256, 256), 1).save(os.path.join(ws.label, name))
+    annos = [
+        {"id": i, "image_id": i % 5, "category_id": 1, "bbox": [200, 100, 50, 20],
+         "area": 10.0, "segmentation": [[50, 20, 200, 20, 200, 100]], "iscrowd": 0}
+        for i in range(10)
+    ]
+    coco = {"images": images, "annotations": annos,
+            "categories": [{"id": 1, "name": "urban"}]}
+    with open(os.path.join(ws.anno, "geococo.json"), "w") as f:
+        json.dump(coco, f)
+
+    results = export_shards(ws, "tar", shards=2, val_fraction=0, workers=2)
+    assert [os.path.basename(p) for p, _, _ in results] == [
+        "train-00000-of-00002.tar", "train-00001-of-00002.tar"
+    ]
+    assert sum(count for _, count, _ in results) == 4
+    with tarfile.open(results[0][0]) as tar:
+        names = tar.getnames()
+        key = names[0][:-4]
+        assert names[:3] == [key + ".png", key + ".label.png", key + ".json"]
+        sample = json.load(tar.extractfile(key + ".json"))
+    assert sample["image"]["file_name"] == key.replace("_", ".") + ".png"
+    assert [a["id"] % 5 for a in sample["annotations"]] == [sample["image"]["id"]] * 2
+
+    # the shards of both splits add up to the requested number
+    out_dir = str(tmp_path / "split")
+    results = export_shards(ws, "tar", out_dir=out_dir, shards=3, val_fraction=0.5)
+    names = sorted(os.path.basename(p) for p, _, _ in results)
+    assert names == [
+        "train-00000-of-00002.tar", "train-00001-of-00002.tar",
+        "val-00000-of-00001.tar",
+    ]
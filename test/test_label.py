@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from ohsome2label import label
+from ohsome2label.config import Parser, workspace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, "example_result")
+
+
+def example_project(path):
+    """copy the raw data of example_result into a new project at path"""
+    os.makedirs(os.path.join(path, "other"))
+    shutil.copytree(
+        os.path.join(EXAMPLE, "other", "raw"), os.path.join(path, "other", "raw")
+    )
+    shutil.copy(
+        os.path.join(EXAMPLE, "other", "colors"), os.path.join(path, "other", "colors")
+    )
+    with open(os.path.join(ROOT, "config", "config.yaml")) as f:
+        config = f.read().replace("./example_result", path)
+    cfg_path = os.path.join(path, "config.yaml")
+    with open(cfg_path, "w") as f:
+        f.write(config)
+    cfg = Parser(cfg_path, os.path.join(ROOT, "config", "schema.yaml")).parse()
+    return cfg, workspace(path)
+
+
+def label_outputs(ws):
+    """get the bytes of the coco file, label pngs and tile geojsons"""
+    outputs = {}
+    for d in (ws.anno, ws.label, ws.tile):
+        for fname in sorted(os.listdir(d)):
+            with open(os.path.join(d, fname), "rb") as f:
+                outputs[os.path.join(os.path.basename(d), fname)] = f.read()
+    return outputs
+
+
+@pytest.mark.parametrize("indent", [2, None])
+@pytest.mark.parametrize("n_imgs, n_annos", [(0, 0), (3, 0), (2, 5)])
+def test_coco_writer_matches_json_dump(tmp_path, indent, n_imgs, n_annos):
+    info = {"description": "test", "date_created": "2020/05/18"}
+    licenses = [{"url": "http://example.com", "id": 4, "name": "license"}]
+    cats = [{"supercategory": "urban", "id": 1, "name": "urban"}]
+    imgs = [{"id": i, "file_name": "{}.png".format(i)} for i in range(n_imgs)]
+    annos = [
+        {"id": i, "segmentation": [[0.5, 1, 2.25, 3]], "bbox": [0, 1, 2, 3]}
+        for i in range(n_annos)
+    ]
+    fpath = str(tmp_path / "coco.json")
+    writer = label.CocoWriter(fpath, info, licenses, indent)
+    for img in imgs:
+        writer.add_image(img)
+    for anno in annos:
+        writer.add_annotation(anno)
+    writer.close(cats)
+
+    coco = {
+        "info": info,
+        "licenses": licenses,
+        "images": imgs,
+        "annotations": annos,
+        "categories": cats,
+    }
+    if indent is None:
+        expected = json.dumps(coco, separators=(",", ":"))
+    else:
+        expected = json.dumps(coco, indent=indent)
+    with open(fpath, encoding="utf-8") as f:
+        assert f.read() == expected
+    assert not os.path.exists(fpath + ".part")
+
+
+def test_gen_label_workers_match_serial(tmp_path):
+    cfg, ws = example_project(str(tmp_path / "serial"))
+    label.gen_label(cfg, ws, cache=False)
+    cfg_pool, ws_pool = example_project(str(tmp_path / "pool"))
+    label.gen_label(cfg_pool, ws_pool, workers=2, chunksize=2, cache=False)
+
+    serial = label_outputs(ws)
+    assert "annotations/geococo.json" in serial
+    assert label_outputs(ws_pool) == serial
+
+
+def test_index_cache_invalidation(tmp_path, capsys):
+    cfg, ws = example_project(str(tmp_path))
+    feats = label.load_index(cfg, ws)[0]
+    assert os.path.exists(os.path.join(ws.other, label.INDEX_CACHE))
+    assert len(label.load_index(cfg, ws)[0]) == len(feats)
+    assert "from cache" in capsys.readouterr().out
+
+    # a changed raw file
+    fpath = os.path.join(ws.raw, "urban_landuse_residential.geojson")
+    with open(fpath, encoding="utf-8") as f:
+        raw = json.load(f)
+    n_dropped = len(raw["features"]) - 1
+    raw["features"] = raw["features"][:1]
+    with open(fpath, "w", encoding="utf-8") as f:
+        json.dump(raw, f)
+    changed = label.load_index(cfg, ws)[0]
+    assert "from cache" not in capsys.readouterr().out
+    assert len(changed) == len(feats) - n_dropped
+
+    # changed tags
+    tags = cfg.tags
+    assert tags[-1]["value"] == "industrial"
+    del tags[-1]
+    assert len(cfg.tags) == 3
+    assert len(label.load_index(cfg, ws)[0]) < len(changed)
+    assert "from cache" not in capsys.readouterr().out
+    assert len(label.load_index(cfg, ws)[0]) < len(changed)
+    assert "from cache" in capsys.readouterr().out
+
+
+def test_resume_truncated_manifest(tmp_path, capsys):
+    cfg, ws = example_project(str(tmp_path / "fresh"))
+    label.gen_label(cfg, ws)
+    fresh = label_outputs(ws)
+
+    cfg, ws = example_project(str(tmp_path / "resumed"))
+    label.gen_label(cfg, ws, resume=True)
+    # a run killed while writing the manifest
+    path = os.path.join(ws.other, label.LABEL_MANIFEST)
+    with open(path, encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines[: len(lines) // 2])
+        f.write(lines[len(lines) // 2][:20])
+    os.remove(os.path.join(ws.anno, "geococo.json"))
+    capsys.readouterr()
+    label.gen_label(cfg, ws, resume=True)
+    resumed = "Resume: {} tiles unchanged".format(len(lines) // 2)
+    assert resumed in capsys.readouterr().out
+    assert label_outputs(ws) == fresh
+
+
+def test_tag_label_empty_value():
+    tags = [
+        {"label": "building", "key": "building", "value": ""},
+        {"label": "urban", "key": "landuse", "value": "residential"},
+    ]
+    assert label.tag_label(tags, {"landuse": "residential"}) == "urban"
+    assert label.tag_label(tags, {"building": "yes", "landuse": "residential"}) == (
+        "building"
+    )
+    assert label.tag_label(tags, {"landuse": "forest"}) is None
+
+
+def test_gen_label_raises_tile_errors(tmp_path, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("broken tile")
+
+    monkeypatch.setattr(label, "check_topo", broken)
+    cfg, ws = example_project(str(tmp_path))
+    with pytest.raises(ValueError, match="broken tile"):
+        label.gen_label(cfg, ws, cache=False)
+    assert os.listdir(ws.anno) == []
@@ -0,0 +1,143 @@
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from shapely.geometry import box
+
+from ohsome2label.overpass import (
+    OverpassClient,
+    OverpassError,
+    assign_inners,
+    classify_polygon_features,
+    download_overpass,
+    is_area,
+    make_ring,
+    parse_status,
+)
+
+
+def test_make_ring_joins_shuffled_fragments():
+    coords = [(i, i * i % 7) for i in range(50)]
+    coords.append(coords[0])
+    parts = [coords[i:i + 6] for i in range(0, 50, 5)]
+    rnd = random.Random(1)
+    rnd.shuffle(parts)
+    parts = [part[::-1] if rnd.random() < 0.5 else part for part in parts]
+
+    rings = make_ring(parts)
+    assert len(rings) == 1
+    ring = rings[0]
+    assert ring[0] == ring[-1]
+    assert len(ring) == len(coords)
+    assert set(ring) == set(coords)
+
+
+def test_make_ring_keeps_open_chain():
+    rings = make_ring([[(0, 0), (1, 0)], [(2, 0), (1, 0)], [(5, 5), (6, 6)]])
+    assert sorted(map(sorted, rings)) == [[(0, 0), (1, 0), (2, 0)], [(5, 5), (6, 6)]]
+
+
+def test_assign_inners_nested_island():
+    # outer with a hole, an island in the hole and a hole in the island
+    outers = [box(0, 0, 10, 10), box(3, 3, 7, 7)]
+    inners = [box(2, 2, 8, 8), box(4, 4, 6, 6), box(20, 20, 21, 21)]
+    assert assign_inners(outers, inners) == [[0], [1]]
+
+
+def test_classify_polygon_features():
+    pairs = [("building", "yes"), ("highway", "residential"), ("highway", "services"),
+             ("natural", "coastline"), ("name", "x")]
+    assert classify_polygon_features(pairs) == [True, False, True, False, False]
+    assert is_area({"landuse": "residential"})
+    assert not is_area({"landuse": "residential", "area": "no"})
+
+
+def test_parse_status():
+    text = (
+        "Rate limit: 2\n"
+        "Slot available after: 2020-05-18T10:00:07Z, in 7 seconds.\n"
+        "Slot available after: 2020-05-18T10:00:12Z, in 12 seconds.\n"
+    )
+    assert parse_status(text) == (2, 0, 7)
+    assert parse_status("Rate limit: 2\n1 slots available now.\n") == (2, 1, 0)
+    assert parse_status("Rate limit: 0\n") == (0, 1, 0)
+
+
+ELEMENTS = {"version": 0.6, "elements": [{"type": "way", "id": 1}]}
+RUNTIME_ERROR = dict(ELEMENTS, remark="runtime error: Query timed out after 1 seconds.")
+
+
+class FakeOverpass(BaseHTTPRequestHandler):
+    """/ok answers, /error reports a runtime error, /stall does not answer"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # no /status page
+        self.send_response(404)
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.posts.append(self.path)
+        if self.path == "/stall/interpreter":
+            time.sleep(2)
+        doc = RUNTIME_ERROR if self.path == "/error/interpreter" else ELEMENTS
+        body = json.dumps(doc).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def fake_overpass():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOverpass)
+    server.daemon_threads = True
+    server.posts = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("failing", ["error", "stall"])
+def test_fetch_fails_over(tmp_path, fake_overpass, failing):
+    url = "http://127.0.0.1:{}/{}/interpreter".format(fake_overpass.server_port, "{}")
+    client = OverpassClient(
+        [url.format(failing), url.format("ok")], retries=1, backoff=0, grace=0.5
+    )
+    fpath = str(tmp_path / "overpass.json")
+    assert client.fetch("[out:json][timeout:0];way;out geom;", fpath) > 0
+    with open(fpath) as f:
+        assert json.load(f) == ELEMENTS
+    assert fake_overpass.posts[0] == "/{}/interpreter".format(failing)
+    assert fake_overpass.posts[-1] == "/ok/interpreter"
+    assert not (tmp_path / "overpass.json.part").exists()
+    client.close()
+
+    client = OverpassClient([url.format(failing)], retries=0, backoff=0, grace=0.5)
+    with pytest.raises(OverpassError):
+        client.fetch("[out:json][timeout:0];way;out geom;", fpath + "2")
+    assert list(tmp_path.iterdir()) == [tmp_path / "overpass.json"]
+    client.close()
+
+
+def test_download_overpass_raises_on_failed_queries(tmp_path, fake_overpass):
+    url = "http://127.0.0.1:{}/error/interpreter".format(fake_overpass.server_port)
+    cfg = SimpleNamespace(
+        tags=[{"key": "building"}], op_bbox="0,0,1,1", timestamp="2020-01-01"
+    )
+    ws = SimpleNamespace(raw=str(tmp_path))
+    stale = tmp_path / "overpass_query.geojson"
+    stale.write_text("{}")
+    with pytest.raises(OverpassError):
+        download_overpass(cfg, ws, endpoints=[url], retries=0)
+    # the responses are not merged over the former result
+    assert stale.read_text() == "{}"
@@ -0,0 +1,57 @@
+import numpy as np
+from PIL import Image
+from shapely.geometry import Point, Polygon, box
+
+from ohsome2label.raster import burn_outlines, burn_polygons, save_label
+
+
+def test_burn_polygons_fills_pixel_centers_with_holes():
+    polygon = Polygon(
+        [(3.2, 1.7), (27.9, 4.1), (22.4, 29.3), (1.1, 20.6)],
+        [[(8.3, 8.9), (16.6, 9.2), (12.7, 17.4)]],
+    )
+    out = burn_polygons([(polygon, 3)], nx=32, ny=32)
+    expected = np.array(
+        [
+            [polygon.contains(Point(x + 0.5, y + 0.5)) for x in range(32)]
+            for y in range(32)
+        ]
+    )
+    assert out.dtype == np.uint8
+    np.testing.assert_array_equal(out == 3, expected)
+    assert out[12, 12] == 0
+
+
+def test_burn_polygons_draws_later_polygons_on_top():
+    polygons = [(box(0, 0, 8, 8), 1), (box(2, 2, 6, 6), 2), (box(20, 20, 40, 40), 1)]
+    out = burn_polygons(polygons, nx=16, ny=16)
+    assert (out[2:6, 2:6] == 2).all()
+    assert (out[:8, :8] > 0).all()
+    assert out[8:, :8].sum() == 0 and out[:8, 8:].sum() == 0
+
+
+def test_burn_outlines():
+    out = burn_outlines([((1, 2, 5, 6), 4)], nx=8, ny=8)
+    assert (out[2, 1:6] == 4).all() and (out[6, 1:6] == 4).all()
+    assert (out[2:7, 1] == 4).all() and (out[2:7, 5] == 4).all()
+    assert out[3:6, 2:5].sum() == 0
+
+
+def test_save_label_single_channel(tmp_path):
+    index = np.zeros((8, 8), dtype=np.uint8)
+    index[2:5, 1:7] = 2
+    index[6, :] = 1
+    lut = np.array([[0, 0, 0], [255, 0, 0], [0, 128, 255]], dtype=np.uint8)
+
+    save_label(index, str(tmp_path / "p.png"), "palette", lut)
+    save_label(index, str(tmp_path / "g.png"), "grayscale", lut)
+    save_label(index, str(tmp_path / "c.png"), "rgb", lut)
+    palette_im = Image.open(str(tmp_path / "p.png"))
+    gray_im = Image.open(str(tmp_path / "g.png"))
+    rgb_im = Image.open(str(tmp_path / "c.png"))
+
+    assert palette_im.mode == "P" and gray_im.mode == "L" and rgb_im.mode == "RGB"
+    np.testing.assert_array_equal(np.asarray(palette_im), index)
+    np.testing.assert_array_equal(np.asarray(gray_im), index)
+    np.testing.assert_array_equal(np.asarray(palette_im.convert("RGB")), lut[index])
+    np.testing.assert_array_equal(np.asarray(rgb_im), lut[index])
@@ -0,0 +1,31 @@
+import io
+import json
+
+from ohsome2label import reader
+
+
+def test_iter_array_small_chunks():
+    doc = {
+        "attribution": {"text": "features"},
+        "features": [{"id": i, "name": 'a"b' * i, "v": 1.5e10} for i in range(20)],
+        "after": 12345,
+    }
+    chunks = reader.read_chunks(io.StringIO(json.dumps(doc)), size=3)
+    assert list(reader.iter_array(chunks, "features")) == doc["features"]
+
+
+def test_iter_array_empty():
+    assert list(reader.iter_array(['{"features" : [ ] }'], "features")) == []
+
+
+def test_iter_array_split_at_every_offset():
+    text = json.dumps(
+        {
+            "version": 0.6,
+            "elements": [{"id": -12, "lat": 49.3711, "e": 1.5e-10}, 7, True],
+            "n": 100,
+        }
+    )
+    for i in range(len(text) + 1):
+        elements = list(reader.iter_array([text[:i], text[i:]], "elements"))
+        assert elements == [{"id": -12, "lat": 49.3711, "e": 1.5e-10}, 7, True], i
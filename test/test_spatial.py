@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from shapely.geometry import Polygon, box
+
+from ohsome2label.spatial import SHAPELY_2, FeatureIndex
+
+
+def test_feature_index_keeps_identical_geometries():
+    geoms = [box(0, 0, 1, 1), box(0, 0, 1, 1), box(5, 5, 6, 6)]
+    tree = FeatureIndex(geoms)
+    assert tree.query(box(0.5, 0.5, 2, 2)) == [0, 1]
+
+
+def test_feature_index_intersects_drops_envelope_hits():
+    # the diagonal triangle only touches the query box with its envelope
+    geoms = [box(0, 0, 1, 1), Polygon([(2, 0), (12, 10), (12, 0)])]
+    tree = FeatureIndex(geoms)
+    query = box(2, 8, 3, 9)
+    assert tree.query(query) == [1]
+    assert tree.intersects(query, [1]) == []
+
+
+def test_feature_index_intersects_matches_geometries():
+    geoms = [box(i, i, i + 2, i + 2) for i in range(50)]
+    tree = FeatureIndex(geoms)
+    query = Polygon([(10, 10), (20, 10), (10, 20)])
+    expected = [i for i, g in enumerate(geoms) if g.intersects(query)]
+    assert tree.intersects(query, tree.query(query)) == expected
+
+
+@pytest.mark.skipif(not SHAPELY_2, reason="needs shapely >= 2")
+def test_feature_index_geometry_array_is_built_once():
+    geoms = [box(i, i, i + 1, i + 1) for i in range(10)]
+    tree = FeatureIndex(geoms)
+    array = tree._geoms
+    assert isinstance(array, np.ndarray) and array.dtype == object
+    tree.intersects(box(0, 0, 3, 3), tree.query(box(0, 0, 3, 3)))
+    assert tree._geoms is array
@@ -0,0 +1,18 @@
+from shapely.geometry import box
+
+from ohsome2label import store
+from ohsome2label.tile import Bbox
+
+
+def test_store_roundtrip(tmp_path):
+    features = [
+        (box(0, 0, 1, 1), {"@osmId": "way/1", "name": "Straße"}),
+        (box(10, 10, 11, 11), {"@osmId": "way/2"}),
+    ]
+    fpath = str(tmp_path / "features.npz")
+    assert store.write_store(fpath, features) == 2
+
+    fs = store.FeatureStore(fpath)
+    assert len(fs) == 2
+    assert [(g.wkt, p) for g, p in fs.iter()] == [(g.wkt, p) for g, p in features]
+    assert fs.query(Bbox(0.5, 0.5, 2, 2)).tolist() == [0]
@@ -0,0 +1,55 @@
+import io
+
+from ohsome2label import tfrecord
+from ohsome2label.tfrecord import (
+    _update,
+    _varint,
+    bytes_feature,
+    crc32c,
+    encode_example,
+    frame_record,
+    int64_feature,
+    iter_records,
+    open_writer,
+)
+
+
+def test_crc32c():
+    assert crc32c(b"123456789") == 0xE3069283
+    data = bytes(range(256)) * 40 + b"tail"
+    assert crc32c(data) == _update(0xFFFFFFFF, data) ^ 0xFFFFFFFF
+
+
+def test_encode_example():
+    assert _varint(300) == b"\xac\x02"
+    example = encode_example({"a": int64_feature(1), "b": bytes_feature(b"x")})
+    # Example{features{feature{key: "a" value{int64_list{1}}} feature{...}}}
+    assert example == (
+        b"\x0a\x18"
+        b"\x0a\x0a\x0a\x01a\x12\x05\x1a\x03\x0a\x01\x01"
+        b"\x0a\x0a\x0a\x01b\x12\x05\x0a\x03\x0a\x01x"
+    )
+
+
+def test_record_round_trip():
+    records = [b"", b"abc", bytes(5000)]
+    f = io.BytesIO(b"".join(frame_record(r) for r in records))
+    assert list(iter_records(f)) == records
+
+
+def test_open_writer(tmp_path):
+    records = [b"abc", bytes(300)]
+    path = str(tmp_path / "a.tfrecord")
+    with open_writer(path) as writer:
+        for record in records:
+            writer.write(record)
+    with open(path, "rb") as f:
+        assert list(iter_records(f)) == records
+
+
+def test_fast_checksums(monkeypatch):
+    monkeypatch.setattr(tfrecord, "_crc32c", lambda data: 0)
+    assert tfrecord.fast_checksums()
+    monkeypatch.setattr(tfrecord, "_crc32c", None)
+    monkeypatch.setattr(tfrecord.importlib.util, "find_spec", lambda name: None)
+    assert not tfrecord.fast_checksums()
@@ -1,3 +1,5 @@
+import pytest
+
 from ohsome2label import tile
 
 
@@ -7,3 +9,29 @@ def test_truncate():
 
 def test_truncate_xy():
     assert tile.truncate_xy(12, 34) == (12, 34)
+
+
+def test_xy_array():
+    lon = [8.6, -200, 12]
+    lat = [49.4, 34, 90]
+    x, y = tile.xy_array(lon, lat)
+    for i in range(3):
+        assert (x[i], y[i]) == pytest.approx(tile.xy(lon[i], lat[i]))
+
+
+def test_apply_transform_array():
+    trans = tile.tile_get_transform(tile.Tile(8586, 5597, 14))
+    coords = [tile.xy(8.68, 49.41), tile.xy(8.69, 49.4)]
+    expected = tile.apply_transform(coords, trans)
+    result = tile.apply_transform_array(coords, trans)
+    for i in range(2):
+        assert tuple(result[i]) == pytest.approx(expected[i])
+
+
+def test_chunk_bboxes_cover_bbox():
+    bbox = tile.Bbox(8.625, 49.3711, 8.7334, 49.4397)
+    chunks = list(tile.chunk_bboxes(bbox, 14, 2))
+    area = sum((c.east - c.west) * (c.north - c.south) for c in chunks)
+    assert area == pytest.approx((bbox.east - bbox.west) * (bbox.north - bbox.south))
+    assert min(c.west for c in chunks) == bbox.west
+    assert max(c.north for c in chunks) == bbox.north
@@ -0,0 +1,71 @@
+import io
+import os
+
+from PIL import Image
+
+from ohsome2label.tile import Tile
+from ohsome2label.tilecache import TileCache
+
+
+def png_bytes(color=0):
+    buf = io.BytesIO()
+    Image.new("L", (4, 4), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_tile_cache_lru(tmp_path):
+    tiles = [png_bytes(0), png_bytes(255)]
+    cache = TileCache(str(tmp_path / "cache"), max_size=max(map(len, tiles)))
+    keys = [cache.key("bing", Tile(i, 0, 1), "http://{q}") for i in range(2)]
+    for i, key in enumerate(keys):
+        src = str(tmp_path / "{}.png".format(i))
+        with open(src, "wb") as f:
+            f.write(tiles[i])
+        cache.put(key, src)
+
+    dst = str(tmp_path / "linked.png")
+    assert cache.get(keys[0], dst) == len(tiles[0])
+    assert open(dst, "rb").read() == tiles[0]
+
+    # the second tile is the least recently used one
+    assert cache.evict() == 1
+    assert cache.get(keys[1], dst) is None
+    assert cache.get(keys[0], dst) == len(tiles[0])
+    cache.close()
+
+
+def test_tile_cache_without_hardlinks(tmp_path, monkeypatch):
+    def no_link(src, dst):
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr(os, "link", no_link)
+    tile = png_bytes()
+    cache = TileCache(str(tmp_path / "cache"), max_size=1)
+    key = cache.key("bing", Tile(0, 0, 1), "http://{q}")
+    src = str(tmp_path / "a.png")
+    with open(src, "wb") as f:
+        f.write(tile)
+    cache.put(key, src)
+    os.remove(src)
+
+    dst = str(tmp_path / "b.png")
+    assert cache.get(key, dst) == len(tile)
+    assert cache.evict() == 1
+    assert not os.path.islink(dst)
+    assert open(dst, "rb").read() == tile
+    cache.close()
+
+
+def test_tile_cache_refuses_invalid_tiles(tmp_path):
+    cache = TileCache(str(tmp_path / "cache"))
+    key = cache.key("bing", Tile(0, 0, 1), "http://{q}")
+    src = str(tmp_path / "a.png")
+    with open(src, "wb") as f:
+        f.write(b"<html>quota exceeded</html>")
+    cache.put(key, src)
+
+    dst = str(tmp_path / "b.png")
+    assert cache.get(key, dst) is None
+    assert not os.path.exists(dst)
+    assert cache.size() == 0
+    cache.close()
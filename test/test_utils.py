@@ -0,0 +1,160 @@
+import io
+import json
+import os
+import socket
+from types import SimpleNamespace
+
+import pytest
+import requests
+from PIL import Image
+
+from ohsome2label import utils
+from ohsome2label.tile import Bbox
+from ohsome2label.tilecache import TileCache
+
+
+class BrokenResponse(object):
+    def __init__(self, error, status=None):
+        self.error = error
+        self.status = status
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status is not None:
+            raise requests.exceptions.HTTPError(self.status)
+
+    def iter_content(self, chunk_size):
+        yield b"partial"
+        raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+class BrokenSession(object):
+    def __init__(self, error, status=None):
+        self.response = BrokenResponse(error, status)
+
+    def get(self, url, params, stream, timeout):
+        assert timeout == utils.TIMEOUT
+        return self.response
+
+
+@pytest.mark.parametrize(
+    "error",
+    [requests.exceptions.ChunkedEncodingError(), requests.exceptions.ReadTimeout()],
+)
+def test_download_broken_body(tmp_path, error):
+    fpath = str(tmp_path / "14.1.1.png")
+    session = BrokenSession(error)
+    assert utils.download(fpath, "http://tiles", session=session) is None
+    assert os.listdir(str(tmp_path)) == []
+    assert session.response.closed
+
+
+def test_download_http_error_closes_response(tmp_path):
+    fpath = str(tmp_path / "14.1.1.png")
+    session = BrokenSession(None, status=503)
+    assert utils.download(fpath, "http://tiles", session=session) is None
+    assert session.response.closed
+
+
+def test_download_stalled_server(tmp_path):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    # accepts the connection but never answers
+    server.listen(1)
+    url = "http://127.0.0.1:{}/".format(server.getsockname()[1])
+    fpath = str(tmp_path / "14.1.1.png")
+    assert utils.download(fpath, url, timeout=(1, 0.5)) is None
+    assert os.listdir(str(tmp_path)) == []
+    server.close()
+
+
+def image_workspace(tmp_path, tiles):
+    other, tmp = tmp_path / "other", tmp_path / "tmp"
+    other.mkdir()
+    tmp.mkdir()
+    (other / "tile_list").write_text("".join(t + "\n" for t in tiles))
+    cfg = SimpleNamespace(img_api="custom", img_url="http://tiles/{z}/{x}/{y}")
+    return cfg, SimpleNamespace(other=str(other), tmp=str(tmp))
+
+
+def fake_download(bodies):
+    def download(fpath, api, session=None):
+        body = bodies[os.path.basename(fpath)]
+        with open(fpath, "wb") as f:
+            f.write(body)
+        return len(body)
+
+    return download
+
+
+def png_bytes(color=0):
+    buf = io.BytesIO()
+    Image.new("L", (4, 4), color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def test_download_img_rejects_invalid_images(tmp_path, monkeypatch):
+    bodies = {
+        "14.1.1.png": png_bytes(),
+        "14.1.2.png": b"",
+        "14.1.3.png": b"<html>quota exceeded</html>",
+    }
+    monkeypatch.setattr(utils, "download", fake_download(bodies))
+    cfg, ws = image_workspace(tmp_path, [n[:-4] for n in sorted(bodies)])
+    utils.download_img(cfg, ws)
+
+    assert os.listdir(ws.tmp) == ["14.1.1.png"]
+    with open(os.path.join(ws.other, utils.IMAGE_MANIFEST)) as f:
+        records = [json.loads(line) for line in f]
+    assert [(r["status"], r["bytes"]) for r in records] == [
+        ("ok", len(bodies["14.1.1.png"])),
+        ("failed", 0),
+        ("failed", 0),
+    ]
+
+
+def test_download_img_caches_only_valid_images(tmp_path, monkeypatch):
+    bodies = {"14.1.1.png": png_bytes(), "14.1.2.png": b"<html>error</html>"}
+    monkeypatch.setattr(utils, "download", fake_download(bodies))
+    cfg, ws = image_workspace(tmp_path, [n[:-4] for n in sorted(bodies)])
+    cache = TileCache(str(tmp_path / "cache"))
+    utils.download_img(cfg, ws, resume=True, cache=cache)
+    assert cache.size() == len(bodies["14.1.1.png"])
+
+    # the failed tile is fetched again instead of coming from the cache
+    bodies["14.1.2.png"] = png_bytes(255)
+    utils.download_img(cfg, ws, resume=True, cache=cache)
+    with open(os.path.join(ws.other, utils.IMAGE_MANIFEST)) as f:
+        states = [json.loads(line)["status"] for line in f]
+    assert states == ["ok", "failed", "exists", "ok"]
+    cache.close()
+
+
+def test_download_osm_chunks_raises_on_failed_chunks(tmp_path, monkeypatch):
+    def download(fpath, api, params={}, session=None):
+        if fpath.endswith(".1.geojson"):
+            return None
+        with open(fpath, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": []}, f)
+        return 1
+
+    monkeypatch.setattr(utils, "download", download)
+    cfg = SimpleNamespace(
+        url="http://ohsome",
+        bboxes=Bbox(8.6, 49.38, 8.72, 49.42),
+        zoom=14,
+        timestamp="2020-01-01",
+        properties=None,
+        combine=False,
+        types="polygon",
+        tags=[{"label": "building", "key": "building", "value": ""}],
+    )
+    stale = tmp_path / "building_building_.geojson"
+    stale.write_text("{}")
+    with pytest.raises(utils.RequestError):
+        utils.download_osm_chunks(cfg, SimpleNamespace(raw=str(tmp_path)), 1)
+    # the chunks are not merged over the former result
+    assert stale.read_text() == "{}"
@@ -6,7 +6,8 @@
 r"""Convert raw Microsoft COCO dataset to TFRecord for object_detection.
 
 1) Installation:
-    pip install pycocotools-windows
+    geococo.json is read with ohsome2label.coco, install ohsome2label, e.g.
+    pip install --editable .
 
 2) For easy use of this script, Your coco dataset directory struture should like this :
     +Your coco dataset root
@@ -29,7 +30,7 @@ from __future__ import division
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
-from pycocotools.coco import COCO
+from ohsome2label.coco import read_coco
 from PIL import Image
 from random import shuffle
 import os, sys
@@ -58,12 +59,10 @@ def clean_image(imgs_dir, preview_dir, annotations_filepath):
     Return:
         no reture
     """
-    coco = COCO(annotations_filepath)
-    img_ids = coco.getImgIds()
-    cat_ids = coco.getCatIds()
+    coco = read_coco(annotations_filepath)
 
-    for index, img_id in enumerate(img_ids):
-        img_detail = coco.loadImgs(img_id)[0]
+    for index in range(len(coco)):
+        img_detail = coco.image(index)
         img_path = os.path.join(imgs_dir, img_detail['file_name'])
         preview_path = os.path.join(preview_dir, img_detail['file_name'])
         if not os.path.isfile(preview_path):
@@ -71,44 +70,31 @@ def clean_image(imgs_dir, preview_dir, annotations_filepath):
 
 
 def load_coco_dection_dataset(imgs_dir, annotations_filepath):
-    """Load data from dataset by pycocotools. This tools can be download from "http://mscoco.org/dataset/#download"
+    """Load data from dataset by the array backed coco index of ohsome2label
     Args:
         imgs_dir: directories of coco images
         annotations_filepath: file path of coco annotations file
     Return:
         coco_data: list of dictionary format information of each image
     """
-    coco = COCO(annotations_filepath)
-    img_ids = coco.getImgIds()
-    cat_ids = coco.getCatIds()
-
-    # if shuffle_img:
-    #     shuffle(img_ids)
+    coco = read_coco(annotations_filepath, save=True)
 
     coco_data = []
 
-    nb_imgs = len(img_ids)
-    for index, img_id in enumerate(img_ids):
+    nb_imgs = len(coco)
+    for index in range(nb_imgs):
         img_info = {}
-        bboxes = []
-        labels = []
-        entity = []
 
-        img_detail = coco.loadImgs(img_id)[0]
+        img_detail = coco.image(index)
         pic_height = img_detail['height']
         pic_width = img_detail['width']
 
-        ann_ids = coco.getAnnIds(imgIds=img_id, catIds=cat_ids)
-        anns = coco.loadAnns(ann_ids)
-        for ann in anns:
-            bboxes_data = ann['bbox']
-            cats = coco.loadCats(ann['category_id'])[0]["name"]
-            bboxes_data = [bboxes_data[0] / float(pic_width), bboxes_data[1] / float(pic_height), \
-                           bboxes_data[2] / float(pic_width), bboxes_data[3] / float(pic_height)]
-            # the format of coco bounding boxs is [Xmin, Ymin, width, height]
-            bboxes.append(bboxes_data)
-            labels.append(ann['category_id'])
-            entity.append(cats.encode('utf8'))
+        # the annotations of an image are one slice of the index columns
+        anns = coco.annotations(index)
+        scale = np.array([pic_width, pic_height, pic_width, pic_height], dtype=float)
+        bboxes = (coco.bboxes[anns] / scale).tolist()
+        labels = coco.category_ids[anns].tolist()
+        entity = [coco.category_name(c).encode('utf8') for c in labels]
 
         img_path = os.path.join(imgs_dir, img_detail['file_name'])
         #preview_path = os.path.join(preview_dir, img_detail['file_name'])